@@ -0,0 +1,93 @@
+import logging
+import time
+
+from contextlib import contextmanager
+from threading import Lock
+
+import mysql.connector
+
+from mysql.connector import pooling
+
+from chat.config import mysql_host, mysql_port, mysql_user, mysql_password, mysql_db, mysql_pool_size, \
+    mysql_connect_timeout, mysql_retry_delay, mysql_max_retry_delay
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = Lock()
+
+# number of failed attempts in a row and when to try connecting again
+_failures = 0
+_retry_at = 0
+
+
+class DatabaseUnavailableError(Exception):
+    """Raised while waiting for the next reconnect attempt after the database could not be reached"""
+
+
+def _get_pool():
+    """Get the connection pool and create it on first use"""
+    global _pool
+    if _pool is None:
+        _pool = pooling.MySQLConnectionPool(pool_name='questpal',
+                                            pool_size=mysql_pool_size,
+                                            host=mysql_host,
+                                            port=mysql_port,
+                                            user=mysql_user,
+                                            passwd=mysql_password,
+                                            database=mysql_db,
+                                            connection_timeout=mysql_connect_timeout)
+        logger.info(f"Created MySQL connection pool with {mysql_pool_size} connections")
+    return _pool
+
+
+def _get_connection():
+    """Get a healthy connection from the pool or fail fast while backing off from an unreachable database"""
+    global _failures, _retry_at
+
+    with _pool_lock:
+        if time.monotonic() < _retry_at:
+            raise DatabaseUnavailableError(f"Database unreachable, next attempt in "
+                                           f"{_retry_at - time.monotonic():.0f} seconds")
+        try:
+            # the pool pings the connection and reconnects if the server dropped it
+            db = _get_pool().get_connection()
+        except pooling.PoolError:
+            # all connections are in use. this is not a problem of the database
+            raise
+        except mysql.connector.Error:
+            _failures += 1
+            delay = min(mysql_retry_delay * 2 ** (_failures - 1), mysql_max_retry_delay)
+            _retry_at = time.monotonic() + delay
+            logger.warning(f"Connecting to MySQL failed {_failures} time(s) in a row. Retrying in {delay} seconds.")
+            raise
+
+        if _failures:
+            logger.info(f"Reconnected to MySQL after {_failures} failed attempt(s)")
+        _failures = 0
+        _retry_at = 0
+        return db
+
+
+@contextmanager
+def get_connection():
+    """Borrow a connection from the shared pool. The connection is handed back to the pool afterwards."""
+    db = _get_connection()
+    try:
+        yield db
+    finally:
+        try:
+            # returns the connection to the pool instead of closing it
+            db.close()
+        except mysql.connector.Error as e:
+            # a broken connection is still put back and reconnected on its next use
+            logger.warning(f"Resetting MySQL connection failed: {e}")
+
+
+def iter_rows(cursor, batch_size):
+    """Iterate over the result of a query while fetching only batch_size rows at a time"""
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
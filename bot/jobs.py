@@ -0,0 +1,61 @@
+import logging
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundJobRunner:
+    """Run slow jobs on a pool of worker threads so the job queue thread only schedules them.
+
+    A job is skipped while its previous run is still going on. Threads can't be stopped, so runs that take longer
+    than their timeout are reported and blocking calls inside the jobs need timeouts of their own.
+    """
+
+    def __init__(self, max_workers):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='background-job')
+        # job name => (future, start time) of the latest run
+        self._runs = {}
+        # names of jobs whose timeout has been reported for the current run
+        self._reported = set()
+        self._lock = Lock()
+
+    def wrap(self, callback, timeout):
+        """Get a job callback that hands the actual callback over to the worker pool"""
+        name = callback.__name__
+
+        @wraps(callback)
+        def submit(context):
+            with self._lock:
+                if name in self._runs:
+                    (future, start_time) = self._runs[name]
+                    if not future.done():
+                        duration = time.monotonic() - start_time
+                        if duration > timeout and name not in self._reported:
+                            self._reported.add(name)
+                            logger.error(f"Job {name} exceeded its timeout of {timeout} seconds and is still running")
+                        logger.warning(f"Skipping job {name}, the previous run is still running after "
+                                       f"{duration:.0f} seconds")
+                        return
+
+                self._reported.discard(name)
+                future = self._executor.submit(self._run, name, callback, context)
+                self._runs[name] = (future, time.monotonic())
+
+        return submit
+
+    @staticmethod
+    def _run(name, callback, context):
+        start_time = time.monotonic()
+        try:
+            callback(context)
+        except Exception:
+            logger.exception(f"Job {name} failed")
+        logger.debug(f"Job {name} finished after {time.monotonic() - start_time:.1f} seconds")
+
+    def shutdown(self):
+        """Stop accepting jobs without waiting for running jobs"""
+        self._executor.shutdown(wait=False)
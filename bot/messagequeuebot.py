@@ -1,30 +1,32 @@
 import logging
 import telegram.bot
 
-from telegram.ext import messagequeue
+from bot.scheduler import RequestScheduler
 
 logger = logging.getLogger(__name__)
 
 
 class MQBot(telegram.bot.Bot):
-    """A subclass of Bot which delegates send method handling to MessageQueue"""
+    """A subclass of Bot which sends all API calls through a RequestScheduler to avoid flood limits"""
 
-    def __init__(self, *args, is_queued_def=True, msg_queue=None, **kwargs):
+    def __init__(self, *args, scheduler=None, **kwargs):
 
         super(MQBot, self).__init__(*args, **kwargs)
-        # below 2 attributes should be provided for decorator usage
-        self._is_messages_queued_default = is_queued_def
-        self._msg_queue = msg_queue or messagequeue.MessageQueue()
+        self._scheduler = scheduler or RequestScheduler()
+        self._request = self._scheduler.wrap(self._request)
+        self._scheduler.start()
 
     def __del__(self):
         # noinspection PyBroadException
         try:
-            self._msg_queue.stop()
+            self._scheduler.stop()
         except Exception:
             pass
 
-    @messagequeue.queuedmessage
-    def send_message(self, *args, **kwargs):
-        """Wrapped method would accept new `queued` and `isgroup` OPTIONAL arguments"""
-        logger.info("Sending queued message")
-        return super(MQBot, self).send_message(*args, **kwargs)
+    def get_request_stats(self):
+        """Get the counters of the request scheduler"""
+        return self._scheduler.get_stats()
+
+    def stop_scheduler(self):
+        """Send all queued requests and stop the scheduler"""
+        self._scheduler.stop()
@@ -0,0 +1,330 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import time
+
+from collections import defaultdict, OrderedDict
+from threading import Event, Lock, Thread, get_ident
+
+from telegram import Update
+from telegram.ext import BasePersistence, CallbackContext, TypeHandler
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = ("CREATE TABLE IF NOT EXISTS chat_data (chat_id INTEGER PRIMARY KEY, data BLOB NOT NULL)",
+           "CREATE TABLE IF NOT EXISTS user_data (user_id INTEGER PRIMARY KEY, data BLOB NOT NULL)",
+           "CREATE TABLE IF NOT EXISTS bot_data (id INTEGER PRIMARY KEY, data BLOB NOT NULL)",
+           "CREATE TABLE IF NOT EXISTS conversations ("
+           "name TEXT NOT NULL, "
+           "key TEXT NOT NULL, "
+           "state BLOB NOT NULL, "
+           "PRIMARY KEY (name, key))")
+
+# chats used within this many seconds are not evicted, even if there are more resident chats than allowed
+MIN_RESIDENT_TIME = 60
+
+
+def mark_chat_used(update: Update, context: CallbackContext):
+    """Keep the chat data of the chat of an update in memory and save it after each handler"""
+    if update.effective_chat:
+        context.dispatcher.chat_data.mark_used(update.effective_chat.id)
+
+
+def finish_chat_update(update: Update, context: CallbackContext):
+    """Stop saving the chat data of the chat of an update once all handlers are done"""
+    if update.effective_chat:
+        context.dispatcher.chat_data.finish_update(update.effective_chat.id)
+
+
+def add_chat_data_handlers(dispatcher, first_group=-1, last_group=1):
+    """Register handlers that run before and after all other handlers of a dispatcher using SqlitePersistence"""
+    dispatcher.add_handler(TypeHandler(type=Update, callback=mark_chat_used), group=first_group)
+    dispatcher.add_handler(TypeHandler(type=Update, callback=finish_chat_update), group=last_group)
+
+
+class LazyChatData(defaultdict):
+    """Chat data that is loaded from the persistence when a chat is used for the first time.
+
+    Chats that have not been used for idle_timeout seconds are evicted from memory by evict(), as well as the least
+    recently used chats if more than max_resident chats are in memory. Reading chat data doesn't count as use, since
+    the job queue reads all chats after every job. Updates mark their chat as used with mark_used() before the first
+    handler and call finish_update() after the last one.
+    """
+
+    def __init__(self, persistence, idle_timeout, max_resident):
+        super().__init__(dict)
+        self.persistence = persistence
+        self.idle_timeout = idle_timeout
+        self.max_resident = max_resident
+        # chat id => time of the last use, least recently used first
+        self._last_used = OrderedDict()
+        # chat id => thread processing an update of the chat, which may change its data
+        self._updating = {}
+        self._lock = Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    def _touch(self, chat_id):
+        self._last_used[chat_id] = time.monotonic()
+        self._last_used.move_to_end(chat_id)
+
+    def mark_used(self, chat_id):
+        """Remember that a chat has been used just now by an update processed on this thread"""
+        with self._lock:
+            self._touch(chat_id)
+            self._updating[chat_id] = get_ident()
+
+    def is_updating(self, chat_id):
+        """Whether this thread is processing an update of a chat"""
+        with self._lock:
+            return self._updating.get(chat_id) == get_ident()
+
+    def finish_update(self, chat_id):
+        """Forget about the update of a chat processed on this thread"""
+        with self._lock:
+            if self._updating.get(chat_id) == get_ident():
+                del self._updating[chat_id]
+
+    def __missing__(self, chat_id):
+        data = self.persistence.load_chat_data(chat_id)
+        self.loads += 1
+        self[chat_id] = data
+        return data
+
+    def __setitem__(self, chat_id, data):
+        super().__setitem__(chat_id, data)
+        # chats loaded by jobs are evicted once they are idle, but they are not saved after the job
+        with self._lock:
+            self._touch(chat_id)
+
+    def evict(self):
+        """Save and remove chats that are idle or exceed the maximum number of resident chats. Returns their number.
+
+        Only call this from a job. The job queue thread iterates over all chats after each job, so evicting on the same
+        thread can't change the size of the dict during that iteration.
+        """
+        now = time.monotonic()
+        evicted = 0
+        with self._lock:
+            while self._last_used:
+                (chat_id, last_used) = next(iter(self._last_used.items()))
+                idle_time = now - last_used
+                too_many = 0 < self.max_resident < len(self._last_used)
+                if idle_time < max(self.idle_timeout, MIN_RESIDENT_TIME) and \
+                        not (too_many and idle_time >= MIN_RESIDENT_TIME):
+                    break
+                if chat_id in self:
+                    # queue the latest data, in case it has been changed outside of an update
+                    self.persistence.update_chat_data(chat_id, dict.pop(self, chat_id), evicting=True)
+                    evicted += 1
+                del self._last_used[chat_id]
+                self._updating.pop(chat_id, None)
+        self.evictions += evicted
+        return evicted
+
+
+class SqlitePersistence(BasePersistence):
+    """Persist chat data, user data, bot data and conversations in a SQLite database, one row per chat and user.
+
+    Only the data of the chat and user of an update is serialized, chats passed in after jobs are skipped. Rows are
+    written if their data actually changed, in one transaction every flush_interval seconds. flush() writes all
+    resident chats. A pickle file of PicklePersistence is imported on first start.
+    Chat data is loaded when a chat is used and evicted from memory after idle_timeout seconds, see LazyChatData.
+    """
+
+    def __init__(self, database, flush_interval=1.0, pickle_file=None, idle_timeout=3600, max_resident_chats=0):
+        super().__init__(store_user_data=True, store_chat_data=True, store_bot_data=True)
+        self.database = database
+        self.flush_interval = flush_interval
+        self.idle_timeout = idle_timeout
+        self.max_resident_chats = max_resident_chats
+
+        self._db = sqlite3.connect(database, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        for statement in _SCHEMA:
+            self._db.execute(statement)
+        self._db.commit()
+        self._db_lock = Lock()
+
+        # serialized rows waiting to be written. (table, key) => serialized data
+        self._pending = {}
+        self._pending_lock = Lock()
+        # (table, key) => digest of the data that was written last
+        self._digests = {}
+
+        self.chat_data = None
+        self.user_data = None
+        self.bot_data = None
+        self.conversations = None
+
+        if pickle_file and os.path.isfile(pickle_file) and self._is_empty():
+            self._import_pickle_file(pickle_file)
+
+        self._stop = Event()
+        self._thread = Thread(target=self._run, name='persistence', daemon=True)
+        self._thread.start()
+
+    def _is_empty(self):
+        with self._db_lock:
+            return all(self._db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] == 0
+                       for table in ('chat_data', 'user_data', 'bot_data', 'conversations'))
+
+    def _import_pickle_file(self, pickle_file):
+        """Import all data from the single file of a PicklePersistence"""
+        with open(pickle_file, 'rb') as f:
+            data = pickle.load(f)
+        for chat_id, chat_data in data.get('chat_data', {}).items():
+            self._set_row('chat_data', chat_id, pickle.dumps(chat_data))
+        for user_id, user_data in data.get('user_data', {}).items():
+            self._set_row('user_data', user_id, pickle.dumps(user_data))
+        self._set_row('bot_data', 0, pickle.dumps(data.get('bot_data', {})))
+        for name, conversations in data.get('conversations', {}).items():
+            for key, state in conversations.items():
+                self._set_row('conversations', (name, json.dumps(key)), pickle.dumps(state))
+        self._write_pending()
+        logger.info(f"Imported {len(data.get('chat_data', {}))} chats from {pickle_file}")
+
+    def _load_rows(self, query, parameters=()):
+        with self._db_lock:
+            return self._db.execute(query, parameters).fetchall()
+
+    def _set_row(self, table, key, data, forget_digest=False):
+        """Queue a row to be written unless it didn't change since it was written last"""
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+        with self._pending_lock:
+            if self._digests.get((table, key)) == digest and (table, key) not in self._pending:
+                if forget_digest:
+                    del self._digests[(table, key)]
+                return
+            if forget_digest:
+                self._digests.pop((table, key), None)
+            else:
+                self._digests[(table, key)] = digest
+            self._pending[(table, key)] = data
+
+    def get_chat_data(self):
+        if self.chat_data is None:
+            self.chat_data = LazyChatData(self, self.idle_timeout, self.max_resident_chats)
+        return self.chat_data
+
+    def load_chat_data(self, chat_id):
+        """Load the data of a chat, including changes that have not been written yet"""
+        # holding the database lock, queued rows can't be in the middle of being written
+        with self._db_lock:
+            with self._pending_lock:
+                data = self._pending.get(('chat_data', chat_id))
+            if data is not None:
+                return pickle.loads(data)
+            rows = self._db.execute("SELECT data FROM chat_data WHERE chat_id = ?", (chat_id, )).fetchall()
+        if not rows:
+            return {}
+        with self._pending_lock:
+            self._digests[('chat_data', chat_id)] = hashlib.blake2b(rows[0][0], digest_size=16).digest()
+        return pickle.loads(rows[0][0])
+
+    def evict_chat_data(self):
+        """Evict idle chats from memory, see LazyChatData.evict(). Returns the number of evicted chats."""
+        return self.get_chat_data().evict()
+
+    def get_chat_data_stats(self):
+        """Get the number of chats in memory and in total, and how often chats were loaded and evicted"""
+        total = self._load_rows("SELECT COUNT(*) FROM chat_data")[0][0]
+        chat_data = self.get_chat_data()
+        return {'resident': len(chat_data), 'total': total, 'loads': chat_data.loads,
+                'evictions': chat_data.evictions}
+
+    def get_user_data(self):
+        if self.user_data is None:
+            self.user_data = defaultdict(dict)
+            for (user_id, data) in self._load_rows("SELECT user_id, data FROM user_data"):
+                self.user_data[user_id] = pickle.loads(data)
+                self._digests[('user_data', user_id)] = hashlib.blake2b(data, digest_size=16).digest()
+        return self.user_data
+
+    def get_bot_data(self):
+        if self.bot_data is None:
+            rows = self._load_rows("SELECT data FROM bot_data WHERE id = 0")
+            self.bot_data = pickle.loads(rows[0][0]) if rows else {}
+        return self.bot_data
+
+    def get_conversations(self, name):
+        if self.conversations is None:
+            self.conversations = defaultdict(dict)
+            for (conversation, key, state) in self._load_rows("SELECT name, key, state FROM conversations"):
+                self.conversations[conversation][tuple(json.loads(key))] = pickle.loads(state)
+        return self.conversations[name].copy()
+
+    def update_conversation(self, name, key, new_state):
+        if self.conversations is None:
+            self.conversations = defaultdict(dict)
+        if self.conversations[name].get(key) == new_state:
+            return
+        self.conversations[name][key] = new_state
+        self._set_row('conversations', (name, json.dumps(key)), pickle.dumps(new_state))
+
+    def update_chat_data(self, chat_id, data, evicting=False):
+        if not evicting:
+            chat_data = self.get_chat_data()
+            # after every job all resident chats are passed in. only chats of updates handled by this thread changed.
+            # the dispatcher saves after every handler group, so the update stays marked until finish_update()
+            if not chat_data.is_updating(chat_id):
+                return
+            dict.__setitem__(chat_data, chat_id, data)
+        # serialized right away, the data may change again before it is written
+        self._set_row('chat_data', chat_id, pickle.dumps(data), forget_digest=evicting)
+
+    def update_user_data(self, user_id, data):
+        if self.user_data is None:
+            self.user_data = defaultdict(dict)
+        self.user_data[user_id] = data
+        self._set_row('user_data', user_id, pickle.dumps(data))
+
+    def update_bot_data(self, data):
+        self.bot_data = data
+        self._set_row('bot_data', 0, pickle.dumps(data))
+
+    def _write_pending(self):
+        """Write all queued rows in one transaction"""
+        with self._db_lock:
+            with self._pending_lock:
+                pending = self._pending
+                self._pending = {}
+            if pending:
+                self._write_rows(pending)
+
+    def _write_rows(self, pending):
+        try:
+            with self._db:
+                for ((table, key), data) in pending.items():
+                    if table == 'conversations':
+                        self._db.execute("INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)",
+                                         (*key, data))
+                    else:
+                        id_column = {'chat_data': 'chat_id', 'user_data': 'user_id', 'bot_data': 'id'}[table]
+                        self._db.execute(f"INSERT OR REPLACE INTO {table} ({id_column}, data) VALUES (?, ?)",
+                                         (key, data))
+        except sqlite3.Error:
+            # try again with the next flush unless newer data has been queued meanwhile
+            with self._pending_lock:
+                for (row, data) in pending.items():
+                    self._pending.setdefault(row, data)
+            raise
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self._write_pending()
+            except sqlite3.Error as e:
+                logger.error(f"Failed to save persistent data: {e}")
+
+    def flush(self):
+        """Write all resident chats and other changes and stop writing in the background"""
+        self._stop.set()
+        self._thread.join()
+        if self.chat_data is not None:
+            for (chat_id, data) in list(self.chat_data.items()):
+                self._set_row('chat_data', chat_id, pickle.dumps(data))
+        self._write_pending()
@@ -0,0 +1,409 @@
+import heapq
+import itertools
+import logging
+import math
+import random
+import time
+
+from concurrent.futures import Future
+from threading import Condition, Thread
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError
+
+logger = logging.getLogger(__name__)
+
+# requests with a lower priority class are sent first
+PRIORITY_CALLBACK_ANSWER = 0
+PRIORITY_DEFAULT = 1
+PRIORITY_DELETE = 2
+
+_PRIORITIES = {
+    'answerCallbackQuery': PRIORITY_CALLBACK_ANSWER,
+    'deleteMessage': PRIORITY_DELETE,
+}
+
+# callers don't wait for these requests, errors are only logged
+_DEFERRED_METHODS = {'deleteMessage'}
+
+# a queued edit of a message is replaced by a newer edit of the same message
+_COALESCED_METHODS = {'editMessageText', 'editMessageCaption', 'editMessageReplyMarkup', 'editMessageLiveLocation'}
+
+# requests that can be sent again if it is unknown whether they arrived. get* methods are idempotent as well
+_IDEMPOTENT_METHODS = _COALESCED_METHODS | {'answerCallbackQuery', 'deleteMessage', 'sendChatAction'}
+
+# only new messages count towards the limit of a chat. sendChatAction is no message
+_CHAT_LIMITED_METHODS = {'sendMessage', 'sendLocation', 'sendPhoto', 'sendDocument', 'sendVenue', 'sendMediaGroup'}
+
+# polling and setup requests are not subject to flood limits
+_UNSCHEDULED_METHODS = {'getUpdates', 'getMe', 'getWebhookInfo', 'setWebhook', 'deleteWebhook'}
+
+# per-chat buckets that have been full for this many seconds are dropped
+_BUCKET_IDLE_TIME = 60
+
+
+class TokenBucket:
+    """Allow rate requests per second on average with bursts of up to capacity requests"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        # no requests before this time, e.g. after telegram asked to retry later
+        self.paused_until = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def get_delay(self, now):
+        """Get the number of seconds until a request can be sent"""
+        self._refill(now)
+        delay = 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(delay, self.paused_until - now)
+
+    def pause(self, until):
+        self.paused_until = max(self.paused_until, until)
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_idle(self, now):
+        return self.tokens >= self.capacity and now - self.updated >= _BUCKET_IDLE_TIME and now >= self.paused_until
+
+
+class _OutgoingRequest:
+    __slots__ = ('request', 'url', 'data', 'timeout', 'method', 'chat', 'priority', 'futures', 'coalesce_key',
+                 'queued_at', 'not_before', 'attempts')
+
+    def __init__(self, request, url, data, timeout, method, chat, priority, coalesce_key):
+        self.request = request
+        self.url = url
+        self.data = data
+        self.timeout = timeout
+        self.method = method
+        self.chat = chat
+        self.priority = priority
+        # one future per caller waiting for the result
+        self.futures = []
+        self.coalesce_key = coalesce_key
+        self.queued_at = time.monotonic()
+        # time of the next attempt when retrying
+        self.not_before = 0
+        self.attempts = 0
+
+
+class _ScheduledRequest:
+    """Stand-in for the request object of a bot that sends all API calls through a scheduler"""
+
+    def __init__(self, request, scheduler):
+        self._request = request
+        self._scheduler = scheduler
+
+    def post(self, url, data, timeout=None):
+        return self._scheduler.submit(self._request, url, data, timeout)
+
+    def __getattr__(self, name):
+        return getattr(self._request, name)
+
+
+class RequestScheduler:
+    """Send all requests of a bot by priority within global and per-chat rate limits.
+
+    Callback queries are answered first and messages are deleted last. Only new messages count towards the limits of
+    a chat, since handlers wait for their requests on the dispatcher thread. Each chat has at most one request in
+    flight, so requests of a chat are sent one after another. Repeated edits of a message that has not been edited yet are
+    merged into the latest edit.
+
+    If telegram asks to retry later, the chat is paused for that long and the request is sent again. Idempotent
+    requests that time out are retried with jittered exponential backoff. Callers that wait for a result are on the
+    dispatcher thread, so their requests are only retried while they have waited less than max_retry_wait seconds.
+    Deferred deletions are dropped while more than max_queue_size requests are queued.
+    """
+
+    def __init__(self, rate=29, burst=29, chat_rate=1, chat_burst=3, group_rate=20 / 60, group_burst=3, workers=4,
+                 max_retries=5, retry_delay=1, max_retry_wait=3, max_queue_size=1000):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.max_retry_wait = max_retry_wait
+        self.max_queue_size = max_queue_size
+
+        self._bucket = TokenBucket(rate, burst)
+        # chat => token bucket
+        self._chat_buckets = {}
+        # (priority, sequence number, request)
+        self._queue = []
+        self._sequence = itertools.count()
+        # chats with a request in flight
+        self._busy_chats = set()
+        # coalesce key => queued edit
+        self._queued_edits = {}
+        self._condition = Condition()
+        self._threads = []
+        self._stopped = False
+        self._last_prune = time.monotonic()
+        self._stats = {'sent': 0, 'coalesced': 0, 'retry_after': 0, 'network_errors': 0, 'retries': 0, 'failed': 0,
+                       'shed': 0, 'wait_total': 0.0, 'wait_max': 0.0}
+
+    def wrap(self, request):
+        """Get a request object that sends its requests through the scheduler"""
+        return _ScheduledRequest(request, self)
+
+    def start(self):
+        """Start the sender threads"""
+        for number in range(self.workers):
+            thread = Thread(target=self._run, name=f'request-sender-{number}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=10):
+        """Send the queued requests and stop the sender threads"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, request, url, data, timeout=None):
+        """Queue a request and wait for its result. Deferred requests return True right away."""
+        method = url.rsplit('/', 1)[-1]
+        if method in _UNSCHEDULED_METHODS or not self._threads:
+            return request.post(url, data, timeout=timeout)
+
+        chat = str(data['chat_id']) if data.get('chat_id') is not None else None
+        deferred = method in _DEFERRED_METHODS
+        future = None if deferred else Future()
+
+        coalesce_key = None
+        if method in _COALESCED_METHODS:
+            coalesce_key = (method, chat, data.get('message_id'), data.get('inline_message_id'))
+
+        with self._condition:
+            if future is not None:
+                # don't keep the handler waiting while telegram doesn't accept requests of the chat anyway
+                pause = self._get_pause(chat, time.monotonic())
+                if pause > self.max_retry_wait:
+                    self._stats['failed'] += 1
+                    raise RetryAfter(math.ceil(pause))
+
+            queued_edit = self._queued_edits.get(coalesce_key) if coalesce_key is not None else None
+            if queued_edit is not None:
+                # latest edit wins, everybody waiting gets its result
+                queued_edit.data = data
+                queued_edit.timeout = timeout
+                queued_edit.futures.append(future)
+                self._stats['coalesced'] += 1
+            elif deferred and len(self._queue) >= self.max_queue_size:
+                # deletions are the first thing to give up on when telegram can't keep up
+                self._stats['shed'] += 1
+                logger.debug(f"Dropped {method} in chat #{chat}, {len(self._queue)} requests are queued")
+            else:
+                outgoing = _OutgoingRequest(request, url, data, timeout, method, chat,
+                                            _PRIORITIES.get(method, PRIORITY_DEFAULT), coalesce_key)
+                if future is not None:
+                    outgoing.futures.append(future)
+                if coalesce_key is not None:
+                    self._queued_edits[coalesce_key] = outgoing
+                heapq.heappush(self._queue, (outgoing.priority, next(self._sequence), outgoing))
+                self._condition.notify()
+
+        return future.result() if future is not None else True
+
+    def _get_chat_bucket(self, chat):
+        bucket = self._chat_buckets.get(chat)
+        if bucket is None:
+            # groups and channels have much lower limits than private chats
+            if chat.startswith('-') or chat.startswith('@'):
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chat_buckets[chat] = bucket
+        return bucket
+
+    def _get_pause(self, chat, now):
+        """Get the number of seconds until telegram accepts requests of a chat again. Call with the lock held."""
+        pause = self._bucket.paused_until - now
+        if chat is not None and chat in self._chat_buckets:
+            pause = max(pause, self._chat_buckets[chat].paused_until - now)
+        return pause
+
+    def _pop_ready(self, now):
+        """Get the next request that may be sent now and the time to wait otherwise. Call with the lock held."""
+        if not self._queue:
+            return None, None
+        delay = self._bucket.get_delay(now)
+        if delay > 0:
+            return None, delay
+
+        outgoing = None
+        delay = None
+        postponed = []
+        while self._queue:
+            entry = heapq.heappop(self._queue)
+            if entry[2].not_before > now:
+                postponed.append(entry)
+                retry_delay = entry[2].not_before - now
+                delay = retry_delay if delay is None else min(delay, retry_delay)
+                continue
+            chat = entry[2].chat
+            if chat is not None:
+                # waits for the request in flight, which notifies once it is done
+                if chat in self._busy_chats:
+                    postponed.append(entry)
+                    continue
+                if entry[2].method in _CHAT_LIMITED_METHODS:
+                    chat_delay = self._get_chat_bucket(chat).get_delay(now)
+                else:
+                    # other requests only wait if telegram asked to retry later
+                    chat_delay = self._get_pause(chat, now)
+                if chat_delay > 0:
+                    postponed.append(entry)
+                    delay = chat_delay if delay is None else min(delay, chat_delay)
+                    continue
+            outgoing = entry[2]
+            break
+
+        for entry in postponed:
+            heapq.heappush(self._queue, entry)
+
+        if outgoing is not None:
+            self._bucket.consume(now)
+            if outgoing.chat is not None:
+                if outgoing.method in _CHAT_LIMITED_METHODS:
+                    self._get_chat_bucket(outgoing.chat).consume(now)
+                self._busy_chats.add(outgoing.chat)
+            if outgoing.coalesce_key is not None and self._queued_edits.get(outgoing.coalesce_key) is outgoing:
+                del self._queued_edits[outgoing.coalesce_key]
+            wait = now - outgoing.queued_at
+            self._stats['sent'] += 1
+            self._stats['wait_total'] += wait
+            self._stats['wait_max'] = max(self._stats['wait_max'], wait)
+        return outgoing, delay
+
+    def _retry(self, outgoing, not_before):
+        """Queue a request again. Call with the lock held."""
+        outgoing.attempts += 1
+        outgoing.not_before = not_before
+        self._stats['retries'] += 1
+        if outgoing.coalesce_key is not None:
+            queued_edit = self._queued_edits.get(outgoing.coalesce_key)
+            if queued_edit is not None:
+                # a newer edit of the message has been queued meanwhile, its result is the latest anyway
+                queued_edit.futures.extend(outgoing.futures)
+                return
+            self._queued_edits[outgoing.coalesce_key] = outgoing
+        heapq.heappush(self._queue, (outgoing.priority, next(self._sequence), outgoing))
+        self._condition.notify()
+
+    def get_stats(self):
+        """Get counters of sent, merged, throttled, retried, failed and dropped requests and their time in the queue"""
+        with self._condition:
+            stats = dict(self._stats)
+            stats['queued'] = len(self._queue)
+        stats['wait_avg'] = stats['wait_total'] / stats['sent'] if stats['sent'] else 0.0
+        return stats
+
+    def _prune_buckets(self, now):
+        """Drop the buckets of chats that have been idle for a while. Call with the lock held."""
+        if now - self._last_prune < _BUCKET_IDLE_TIME:
+            return
+        self._last_prune = now
+        for chat in [chat for chat, bucket in self._chat_buckets.items() if bucket.is_idle(now)]:
+            if chat not in self._busy_chats:
+                del self._chat_buckets[chat]
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    now = time.monotonic()
+                    self._prune_buckets(now)
+                    (outgoing, delay) = self._pop_ready(now)
+                    if outgoing is not None:
+                        break
+                    if self._stopped and not self._queue:
+                        return
+                    self._condition.wait(delay)
+
+            try:
+                self._send(outgoing)
+            finally:
+                if outgoing.chat is not None:
+                    with self._condition:
+                        self._busy_chats.discard(outgoing.chat)
+                        self._condition.notify_all()
+
+    def _send(self, outgoing):
+        try:
+            result = outgoing.request.post(outgoing.url, outgoing.data, timeout=outgoing.timeout)
+        except RetryAfter as e:
+            with self._condition:
+                self._stats['retry_after'] += 1
+                now = time.monotonic()
+                if outgoing.chat is not None:
+                    self._get_chat_bucket(outgoing.chat).pause(now + e.retry_after)
+                else:
+                    self._bucket.pause(now + e.retry_after)
+                # the request has not been processed, so it can always be sent again
+                if self._may_retry(outgoing, now + e.retry_after):
+                    if not self._is_shed(outgoing):
+                        logger.info(f"Flood limit hit by {outgoing.method} in chat #{outgoing.chat}, "
+                                    f"retrying in {e.retry_after} seconds")
+                        self._retry(outgoing, now + e.retry_after)
+                    return
+            self._fail(outgoing, e)
+            return
+        except NetworkError as e:
+            if isinstance(e, BadRequest):
+                self._fail(outgoing, e)
+                return
+            with self._condition:
+                self._stats['network_errors'] += 1
+                idempotent = outgoing.method in _IDEMPOTENT_METHODS or outgoing.method.startswith('get')
+                # spread retries of many requests that failed at the same time
+                delay = self.retry_delay * 2 ** outgoing.attempts * random.uniform(0.5, 1.5)
+                if idempotent and self._may_retry(outgoing, time.monotonic() + delay):
+                    if not self._is_shed(outgoing):
+                        logger.info(f"{outgoing.method} in chat #{outgoing.chat} failed with '{e}', "
+                                    f"retrying in {delay:.1f} seconds")
+                        self._retry(outgoing, time.monotonic() + delay)
+                    return
+            self._fail(outgoing, e)
+            return
+        except Exception as e:
+            self._fail(outgoing, e)
+            return
+
+        for future in outgoing.futures:
+            future.set_result(result)
+
+    def _may_retry(self, outgoing, not_before):
+        """Whether a request can be sent again at a time without keeping its callers waiting for too long"""
+        if outgoing.attempts >= self.max_retries:
+            return False
+        return not outgoing.futures or not_before - outgoing.queued_at <= self.max_retry_wait
+
+    def _is_shed(self, outgoing):
+        """Whether to drop a deferred request instead of retrying it. Call with the lock held."""
+        if outgoing.futures or len(self._queue) < self.max_queue_size:
+            return False
+        self._stats['shed'] += 1
+        return True
+
+    def _fail(self, outgoing, e):
+        with self._condition:
+            self._stats['failed'] += 1
+        if not outgoing.futures:
+            if isinstance(e, TelegramError):
+                logger.warning(f"Deferred {outgoing.method} in chat #{outgoing.chat} failed: {e}")
+            else:
+                logger.error(f"Deferred {outgoing.method} in chat #{outgoing.chat} failed", exc_info=e)
+        for future in outgoing.futures:
+            future.set_exception(e)
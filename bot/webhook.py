@@ -0,0 +1,184 @@
+import json
+import logging
+import queue
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+
+from quest.data import edit_quests
+from quest.expiry import get_start_of_day, is_expired
+from quest.quest import Quest
+
+logger = logging.getLogger(__name__)
+
+# reward type of stardust quests. these are ignored just like in the database query
+STARDUST_REWARD_TYPE = 3
+
+# maximum size of a request body in bytes
+MAX_BODY_SIZE = 10 * 1024 * 1024
+
+# validated quests waiting to be published as (receive time, quest)
+_pending = queue.Queue()
+
+_stats = {'requests': 0, 'received': 0, 'accepted': 0, 'rejected': 0, 'batches': 0,
+          'latency_total': 0.0, 'latency_max': 0.0, 'scan_delay_total': 0.0}
+_stats_lock = Lock()
+
+
+def _count(**counters):
+    with _stats_lock:
+        for key, value in counters.items():
+            _stats[key] += value
+
+
+def get_webhook_stats():
+    """Get counters and ingest latency in seconds (from receiving a quest until it is published)"""
+    with _stats_lock:
+        stats = dict(_stats)
+    accepted = stats['accepted']
+    stats['latency_avg'] = stats['latency_total'] / accepted if accepted else 0.0
+    stats['scan_delay_avg'] = stats['scan_delay_total'] / accepted if accepted else 0.0
+    return stats
+
+
+def parse_quest(message):
+    """Create a quest from the message of a MAD quest webhook. Returns None if the message is invalid."""
+    try:
+        if message.get('quest_reward_type_raw') == STARDUST_REWARD_TYPE or message.get('quest_stardust'):
+            return None
+
+        stop_id = message['pokestop_id']
+        task_id = message['quest_template']
+        latitude = float(message['latitude'])
+        longitude = float(message['longitude'])
+        timestamp = float(message['timestamp'])
+        pokemon_id = int(message.get('pokemon_id') or 0)
+        item_id = int(message.get('item_id') or 0)
+        item_amount = int(message.get('item_amount') or 0)
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+    if not isinstance(stop_id, str) or not stop_id or not isinstance(task_id, str):
+        return None
+    if not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+        return None
+
+    return Quest(stop_id=stop_id,
+                 stop_name=message.get('name'),
+                 latitude=latitude,
+                 longitude=longitude,
+                 timestamp=timestamp,
+                 pokemon_id=pokemon_id,
+                 item_id=item_id,
+                 item_amount=item_amount,
+                 task_id=task_id)
+
+
+def _apply_pending_quests():
+    """Publish received quests. Everything that arrived meanwhile is applied as a single new snapshot."""
+    while True:
+        batch = [_pending.get()]
+        while True:
+            try:
+                batch.append(_pending.get_nowait())
+            except queue.Empty:
+                break
+
+        # quests from before midnight are outdated already
+        start_of_day = get_start_of_day()
+
+        accepted = []
+        try:
+            with edit_quests() as builder:
+                for (received, quest) in batch:
+                    if is_expired(quest, start_of_day):
+                        continue
+                    # skip quest if older than the existing quest entry
+                    if quest.stop_id in builder.quests and builder.quests[quest.stop_id].timestamp > quest.timestamp:
+                        continue
+                    builder.add_quest(quest)
+                    accepted.append((received, quest))
+        except Exception:
+            logger.exception(f"Applying {len(batch)} quests from webhooks failed")
+            continue
+
+        now = time.time()
+        latencies = [now - received for (received, _) in accepted]
+        with _stats_lock:
+            _stats['accepted'] += len(accepted)
+            _stats['rejected'] += len(batch) - len(accepted)
+            _stats['batches'] += 1
+            _stats['latency_total'] += sum(latencies)
+            _stats['latency_max'] = max([_stats['latency_max']] + latencies)
+            _stats['scan_delay_total'] += sum(max(now - quest.timestamp, 0) for (_, quest) in accepted)
+
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    """Accept batches of MAD webhook payloads and hand the quests over to the publishing thread"""
+
+    def do_POST(self):
+        received = time.time()
+        _count(requests=1)
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            length = -1
+        if not 0 < length <= MAX_BODY_SIZE:
+            self._respond(400, {'error': 'invalid content length'})
+            return
+
+        try:
+            payload = json.loads(self.rfile.read(length))
+        except (UnicodeDecodeError, ValueError):
+            self._respond(400, {'error': 'invalid json'})
+            return
+
+        # MAD sends a list of events, but single events are accepted as well
+        events = payload if isinstance(payload, list) else [payload]
+
+        received_count = 0
+        invalid_count = 0
+        for event in events:
+            if not isinstance(event, dict) or event.get('type') != 'quest':
+                continue
+            received_count += 1
+            quest = parse_quest(event.get('message'))
+            if quest is None:
+                invalid_count += 1
+                continue
+            _pending.put((received, quest))
+
+        _count(received=received_count, rejected=invalid_count)
+        self._respond(200, {'received': received_count, 'invalid': invalid_count})
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._respond(200, get_webhook_stats())
+        else:
+            self._respond(404, {'error': 'not found'})
+
+    def _respond(self, status, body):
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        # requests arrive far too often for the log
+        logger.debug(f"{self.address_string()} - {format % args}")
+
+
+def start_webhook_server(host, port):
+    """Start receiving quest webhooks in background threads. Returns the server."""
+    server = ThreadingHTTPServer((host, port), _WebhookHandler)
+    server.daemon_threads = True
+
+    Thread(target=_apply_pending_quests, name='webhook-apply', daemon=True).start()
+    Thread(target=server.serve_forever, name='webhook-server', daemon=True).start()
+
+    logger.info(f"Receiving quest webhooks on {host}:{port}")
+    return server
@@ -29,8 +29,8 @@ def admins_only(func):
 
 
 @admins_only
-def restart(update: Update, context: CallbackContext, updater: Updater, notify=True):
-    """Restart the bot upon admin command"""
+def restart(update: Update, context: CallbackContext, updater: Updater, shut_down, notify=True):
+    """Restart the bot upon admin command. shut_down stops and saves everything the updater doesn't know about."""
 
     query = update.callback_query
     if query:
@@ -39,6 +39,10 @@ def restart(update: Update, context: CallbackContext, updater: Updater, notify=T
     def stop_and_restart():
         """Gracefully stop the Updater and replace the current process with a new one"""
         updater.stop()
+        # unlike on signals, the updater doesn't write the persistent data when it is stopped
+        if updater.persistence:
+            updater.persistence.flush()
+        shut_down()
         os.execl(sys.executable, sys.executable, *sys.argv)
 
     if notify:
@@ -50,7 +54,7 @@ def restart(update: Update, context: CallbackContext, updater: Updater, notify=T
 
 
 @admins_only
-def git_pull(update: Update, context: CallbackContext, updater: Updater):
+def git_pull(update: Update, context: CallbackContext, updater: Updater, shut_down):
     """Pull the latest changes from git repository"""
 
     query = update.callback_query
@@ -77,4 +81,4 @@ def git_pull(update: Update, context: CallbackContext, updater: Updater):
     notify_devs(text=text)
 
     if up_to_date not in pull_result:
-        restart(update, context, updater, notify=False)
+        restart(update, context, updater, shut_down, notify=False)
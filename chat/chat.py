@@ -12,7 +12,7 @@ from chat.utils import get_emoji, get_text, log_message, extract_ids, get_all_la
     message_user, job_delete_message, delete_message_in_category
 from chat.config import bot_author, bot_provider, tos_date, tos_city, tos_country, quest_map_url, bot_devs
 
-from quest.data import quests, get_all_quests_in_range
+from quest.data import get_all_quests_in_range, get_quest_count
 
 logger = logging.getLogger(__name__)
 
@@ -182,10 +182,12 @@ def start(update: Update, context: CallbackContext):
                                                get_area_radius(chat_data=chat_data))
 
         if not quests_found:
+            total_quests_count = get_quest_count()
             text += f"{get_emoji('warning')} {get_text(lang, 'no_quests_summary')}\n" \
                     f"{get_text(lang, 'no_quests_found_extended_info0')}\n" \
                     f"{get_text(lang, 'no_quests_found_extended_info1')}\n\n" \
-                    f"{get_text(lang, 'no_quests_found_quest_count').format(total_quests_count=len(quests))}\n\n"
+                    f"{get_text(lang, 'no_quests_found_quest_count').format(total_quests_count=total_quests_count)}" \
+                    f"\n\n"
 
             if quest_map_url:
                 text += get_text(lang, 'no_quests_found_map_hint').format(quest_map_url=quest_map_url)
@@ -9,11 +9,21 @@ _config.read(_config_path)
 
 _bot_config = _config['bot']
 bot_use_message_queue = _bot_config.getboolean('use_message_queue', True)
+bot_requests_per_second = _bot_config.getfloat('requests_per_second', 29)
+bot_chat_requests_per_second = _bot_config.getfloat('chat_requests_per_second', 1)
+bot_chat_request_burst = _bot_config.getint('chat_request_burst', 3)
+bot_group_requests_per_minute = _bot_config.getfloat('group_requests_per_minute', 20)
+bot_request_workers = _bot_config.getint('request_workers', 4)
+bot_request_max_retries = _bot_config.getint('request_max_retries', 5)
+bot_request_retry_delay = _bot_config.getfloat('request_retry_delay', 1)
+bot_request_max_retry_wait = _bot_config.getfloat('request_max_retry_wait', 3)
+bot_request_max_queue_size = _bot_config.getint('request_max_queue_size', 1000)
 bot_token = _bot_config.get('token')
 bot_provider = _bot_config.get('provider').replace('@', '')
 bot_devs = [int(user_id) for user_id in _bot_config.get('dev_user_ids').split(",")]
 bot_author = "farstars"
 log_file = _bot_config.get('log_file')
+bot_background_workers = _bot_config.getint('background_workers', 2)
 
 _mysql_config = _config['mysql']
 mysql_host = _mysql_config.get('host')
@@ -21,8 +31,46 @@ mysql_port = _mysql_config.get('port')
 mysql_user = _mysql_config.get('user')
 mysql_password = _mysql_config.get('password')
 mysql_db = _mysql_config.get('database')
+mysql_pool_size = _mysql_config.getint('pool_size', 2)
+mysql_connect_timeout = _mysql_config.getint('connect_timeout', 10)
+mysql_retry_delay = _mysql_config.getint('retry_delay', 5)
+mysql_max_retry_delay = _mysql_config.getint('max_retry_delay', 300)
+mysql_fetch_size = _mysql_config.getint('fetch_size', 1000)
+mysql_pokestop_refresh_interval = _mysql_config.getint('pokestop_refresh_interval', 3600)
+
+persistence_database = _bot_config.get('persistence_database', 'persistent_data.sqlite')
+persistence_flush_interval = _bot_config.getfloat('persistence_flush_interval', 1)
+chat_data_idle_timeout = _bot_config.getint('chat_data_idle_timeout', 3600)
+chat_data_max_resident_chats = _bot_config.getint('chat_data_max_resident_chats', 10000)
 
 msg_folder = 'message_log'
+msg_log_database = _bot_config.get('message_log_database', 'message_log.sqlite')
+msg_log_flush_interval = _bot_config.getfloat('message_log_flush_interval', 1)
+msg_log_cleanup_interval = _bot_config.getint('message_log_cleanup_interval', 3600)
+msg_log_retention_days = _bot_config.getint('message_log_retention_days', 30)
+
+_quests_config = _config['quests'] if _config.has_section('quests') else _config[_config.default_section]
+quests_use_columnar_store = _quests_config.getboolean('use_columnar_store', False)
+quests_range_cache_size = _quests_config.getint('range_cache_size', 1000)
+quests_snapshot_file = _quests_config.get('snapshot_file', 'quests.snapshot')
+quests_snapshot_interval = _quests_config.getint('snapshot_interval', 300)
+quests_timezone = _quests_config.get('timezone', '')
+quests_sweep_interval = _quests_config.getint('sweep_interval', 10)
+quests_sweep_batch_size = _quests_config.getint('sweep_batch_size', 1000)
+
+_hunt_config = _config['hunt'] if _config.has_section('hunt') else _config[_config.default_section]
+hunt_route_planning = _hunt_config.getboolean('route_planning', False)
+hunt_route_time_budget = _hunt_config.getfloat('route_time_budget', 0.5)
+hunt_route_max_stops = _hunt_config.getint('route_max_stops', 500)
+
+_shinies_config = _config['shinies'] if _config.has_section('shinies') else _config[_config.default_section]
+shinies_url = _shinies_config.get('url', 'https://pokemongo.gamepress.gg/pokemon-go-shinies-list')
+shinies_cache_file = _shinies_config.get('cache_file', 'shinies.json')
+
+_webhook_config = _config['webhook'] if _config.has_section('webhook') else _config[_config.default_section]
+webhook_enabled = _webhook_config.getboolean('enabled', False)
+webhook_host = _webhook_config.get('host', '127.0.0.1')
+webhook_port = _webhook_config.getint('port', 8700)
 
 _map_config = _config['map']
 quest_map_url = _map_config.get('quest_map_url')
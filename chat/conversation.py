@@ -11,11 +11,15 @@ from chat.profile import get_language, get_area_center_point, set_area_center_po
     has_area, has_quests
 from chat.utils import get_emoji, get_text, log_message, extract_ids, message_user, MessageType, MessageCategory, \
     delete_message_in_category, job_delete_message
-from chat.config import quest_map_url, maps_url
+from chat.config import quest_map_url, maps_url, hunt_route_planning, hunt_route_time_budget, hunt_route_max_stops
 
-from quest.data import quests, quest_pokemon_list, quest_items_list, shiny_pokemon_list, get_item, get_pokemon, \
-    get_task_by_id, get_all_tasks, get_id_by_task, get_all_quests_in_range, get_closest_quest
+from quest.data import get_item, get_pokemon, get_task_by_id, get_all_tasks, get_id_by_task, \
+    get_all_quests_in_range, get_closest_quest, get_snapshot, get_quest_count
+from quest.cache import QuestRangeCache
+from quest.expiry import get_start_of_day
+from quest.hunt import HuntSession
 from quest.quest import Quest
+from quest.shiny import get_shiny_pokemon
 
 logger = logging.getLogger(__name__)
 
@@ -361,8 +365,9 @@ def choose_quest_type(update: Update, context: CallbackContext):
         if pokemon:
             text += f"\n" \
                     f"*{get_text(lang, 'pokemon')}*\n"
+            shiny_pokemon = get_shiny_pokemon()
             for pokemon_id in pokemon:
-                shiny_tag = f" {get_emoji('shiny')}" if pokemon_id in shiny_pokemon_list else ""
+                shiny_tag = f" {get_emoji('shiny')}" if pokemon_id in shiny_pokemon else ""
                 text += f"- `{get_pokemon(lang, pokemon_id)}`{shiny_tag}\n"
         if items:
             text += f"\n" \
@@ -431,6 +436,8 @@ def choose_pokemon(update: Update, context: CallbackContext):
             chat_data['pokemon'].append(pokemon_id)
             popup_text = get_text(lang, 'added').format(quest=get_pokemon(lang, pokemon_id))
 
+    shiny_pokemon = get_shiny_pokemon()
+
     chosen_pokemon = []
     # list chosen pokemon
     if 'pokemon' in chat_data and chat_data['pokemon']:
@@ -438,7 +445,7 @@ def choose_pokemon(update: Update, context: CallbackContext):
 
         chat_data['pokemon'].sort()
         for pokemon_id in chat_data['pokemon']:
-            shiny_tag = f" {get_emoji('shiny')}" if pokemon_id in shiny_pokemon_list else ""
+            shiny_tag = f" {get_emoji('shiny')}" if pokemon_id in shiny_pokemon else ""
             text += f"- `{get_pokemon(lang, pokemon_id)}`{shiny_tag}\n"
 
         chosen_pokemon = chat_data['pokemon']
@@ -447,12 +454,12 @@ def choose_pokemon(update: Update, context: CallbackContext):
     row = []
 
     # list all pokemon that are available as well as those not available but previously chosen
-    for pokemon_id in sorted(quest_pokemon_list + list(set(chosen_pokemon) - set(quest_pokemon_list))):
+    for pokemon_id in sorted(set(get_snapshot().pokemon_list) | set(chosen_pokemon)):
         if 'pokemon' in chat_data and pokemon_id in chat_data['pokemon']:
             button_text = f"{get_emoji('checked')} "
         else:
             button_text = ""
-        if pokemon_id in shiny_pokemon_list:
+        if pokemon_id in shiny_pokemon:
             button_text += f"{get_pokemon(lang, pokemon_id)} {get_emoji('shiny')}"
         else:
             button_text += get_pokemon(lang, pokemon_id)
@@ -529,7 +536,7 @@ def choose_item(update: Update, context: CallbackContext):
     keyboard = []
     row = []
     # list all items that are available as well as those not available but previously chosen
-    for item_id in sorted(quest_items_list + list(set(chosen_items) - set(quest_items_list))):
+    for item_id in sorted(set(get_snapshot().items_list) | set(chosen_items)):
         if 'items' in chat_data and item_id in chat_data['items']:
             button_text = f"{get_emoji('checked')} {get_item(lang, item_id)}"
         else:
@@ -716,11 +723,13 @@ def start_hunt(update: Update, context: CallbackContext):
             popup_text = f"{get_emoji('warning')} {get_text(lang, 'no_quests_found', format_str=False)}"
             context.bot.answer_callback_query(callback_query_id=query.id, text=popup_text, show_alert=True)
 
+        total_quests_count = get_quest_count()
+
         text = f"{get_emoji('quest')} *{get_text(lang, 'hunt_quests')}*\n\n" \
                f"{get_emoji('warning')} {get_text(lang, 'no_quests_found')}\n" \
                f"{get_text(lang, 'no_quests_found_extended_info0')}\n" \
                f"{get_text(lang, 'no_quests_found_extended_info1')}\n\n" \
-               f"{get_text(lang, 'no_quests_found_quest_count').format(total_quests_count=len(quests))}\n\n"
+               f"{get_text(lang, 'no_quests_found_quest_count').format(total_quests_count=total_quests_count)}\n\n"
 
         if quest_map_url:
             text += get_text(lang, 'no_quests_found_map_hint').format(quest_map_url=quest_map_url)
@@ -893,11 +902,68 @@ def set_start_location(update: Update, context: CallbackContext):
     # remember start time of hunt for stats
     chat_data['hunt_time_start'] = datetime.now().strftime("%H:%M:%S")
 
+    # a hunt from a previous day can't be continued
+    if 'hunt_date' in chat_data and chat_data['hunt_date'] != str(date.today()):
+        clean_up_hunt(chat_data)
+
+    # start a new hunt session or continue the previous one
+    snapshot = get_snapshot()
+    session = get_hunt_session(chat_data, snapshot)
+
+    # plan the order of all quests once instead of looking for the closest quest after each step
+    if hunt_route_planning:
+        session.plan_route(snapshot=snapshot,
+                           start=chat_data['user_location'],
+                           time_budget=hunt_route_time_budget,
+                           max_stops=hunt_route_max_stops)
+
     return send_next_quest(update, context)
 
 
+def get_hunt_session(chat_data, snapshot):
+    """Get the hunt session of a chat and sync it with a snapshot. Starts a new session if there is none."""
+    selection = QuestRangeCache.get_selection(chat_data,
+                                              get_area_center_point(chat_data=chat_data),
+                                              get_area_radius(chat_data=chat_data))
+    start_of_day = get_start_of_day()
+
+    if 'hunt_session' in chat_data:
+        session = chat_data['hunt_session']
+        # merge in new quests and quests of a changed area or changed rewards. drop quests that expired at midnight
+        if session.version != snapshot.unique_version or session.selection != selection or \
+                session.start_of_day != start_of_day:
+            session.update(get_all_quests_in_range(chat_data,
+                                                   get_area_center_point(chat_data=chat_data),
+                                                   get_area_radius(chat_data=chat_data),
+                                                   snapshot=snapshot),
+                           snapshot.unique_version,
+                           snapshot,
+                           selection,
+                           start_of_day)
+        return session
+
+    quests_found = get_all_quests_in_range(chat_data,
+                                           get_area_center_point(chat_data=chat_data),
+                                           get_area_radius(chat_data=chat_data),
+                                           snapshot=snapshot)
+
+    # take over hunt progress stored by previous versions
+    session = HuntSession(quests_found=quests_found,
+                          version=snapshot.unique_version,
+                          collected=chat_data.pop('collected_quests', []),
+                          skipped=chat_data.pop('skipped_quests', []),
+                          ignored=chat_data.pop('ignored_quests', []),
+                          selection=selection,
+                          start_of_day=start_of_day)
+    chat_data['hunt_session'] = session
+
+    return session
+
+
 def clean_up_hunt(chat_data):
     """Clean up previous quest hunt"""
+    if 'hunt_session' in chat_data:
+        del chat_data['hunt_session']
     if 'collected_quests' in chat_data:
         del chat_data['collected_quests']
     if 'skipped_quests' in chat_data:
@@ -920,11 +986,6 @@ def send_next_quest(update: Update, context: CallbackContext):
 
     query = update.callback_query
 
-    # get all quests for chat
-    quests_found = get_all_quests_in_range(chat_data,
-                                           get_area_center_point(chat_data=chat_data),
-                                           get_area_radius(chat_data=chat_data))
-
     today = str(date.today())
 
     # clean up hunt if hunt date does not match / it's a new day
@@ -934,42 +995,23 @@ def send_next_quest(update: Update, context: CallbackContext):
     # remember today's date
     chat_data['hunt_date'] = today
 
+    snapshot = get_snapshot()
+
+    session = get_hunt_session(chat_data, snapshot)
+
     text = f"{get_emoji('quest')} *{get_text(lang, 'hunt_quests')}*\n\n"
 
     if 'enqueue_skipped' in chat_data:
         del chat_data['enqueue_skipped']
-        if 'skipped_quests' in chat_data:
-            text += get_text(lang, 'hunt_quest_enqueued_skipped').format(skipped=len(chat_data['skipped_quests']))
+        if session.skipped:
+            text += get_text(lang, 'hunt_quest_enqueued_skipped').format(skipped=session.enqueue_skipped(snapshot))
             text += "\n\n"
-            del chat_data['skipped_quests']
-
-    # remove all finished quests
-    if 'collected_quests' in chat_data:
-        for stop_id in chat_data['collected_quests']:
-            if stop_id in quests_found:
-                del quests_found[stop_id]
-
-    skipped_quests = {}
-    # remove all skipped quests and treat them differently
-    if 'skipped_quests' in chat_data:
-        for stop_id in chat_data['skipped_quests']:
-            if stop_id in quests_found:
-                skipped_quests[stop_id] = quests_found[stop_id]
-                del quests_found[stop_id]
-
-    # remove all ignored quests
-    if 'ignored_quests' in chat_data:
-        for stop_id in chat_data['ignored_quests']:
-            # remove from open quests
-            if stop_id in quests_found:
-                del quests_found[stop_id]
-            # remove from skipped quests
-            if stop_id in skipped_quests:
-                del skipped_quests[stop_id]
 
     # make sure there are quests remaining
-    if not quests_found:
+    if not session.remaining:
         # check for skipped quests
+        skipped_quests = {stop_id: snapshot.quests[stop_id] for stop_id in session.skipped
+                          if stop_id in snapshot.quests}
         if skipped_quests:
             (closest_distance, closest_stop_id) = get_closest_quest(skipped_quests, chat_data['user_location'])
             current_quest = skipped_quests[closest_stop_id]
@@ -1018,8 +1060,8 @@ def send_next_quest(update: Update, context: CallbackContext):
             hours = time_delta.seconds // 3600
             minutes = (time_delta.seconds // 60) % 60
 
-            collected = len(chat_data['collected_quests']) if 'collected_quests' in chat_data else 0
-            ignored = len(chat_data['ignored_quests']) if 'ignored_quests' in chat_data else 0
+            collected = len(session.collected)
+            ignored = len(session.ignored)
             done_percent = round(100 * collected / (collected + ignored))
 
             time_per_quest = (time_delta.seconds // (collected + ignored)) // 60
@@ -1072,17 +1114,19 @@ def send_next_quest(update: Update, context: CallbackContext):
 
         return ConversationHandler.END
 
-    (closest_distance, closest_stop_id) = get_closest_quest(quests_found, chat_data['user_location'])
-    current_quest = quests_found[closest_stop_id]
+    (closest_distance, closest_stop_id) = session.get_next_quest(snapshot, chat_data['user_location'])
+    current_quest = snapshot.quests[closest_stop_id]
 
-    if skipped_quests:
+    open_count = len(session.remaining)
+    skipped_count = len(session.skipped)
+
+    if skipped_count:
         popup_text = get_text(lang, 'hunt_quest_count_open_and_skipped', format_str=False) \
-            .format(open=len(quests_found), skipped=len(skipped_quests))
-        text += get_text(lang, 'hunt_quest_count_open_and_skipped').format(open=len(quests_found),
-                                                                           skipped=len(skipped_quests))
+            .format(open=open_count, skipped=skipped_count)
+        text += get_text(lang, 'hunt_quest_count_open_and_skipped').format(open=open_count, skipped=skipped_count)
     else:
-        popup_text = get_text(lang, 'hunt_quest_count_open', format_str=False).format(open=len(quests_found))
-        text += get_text(lang, 'hunt_quest_count_open').format(open=len(quests_found))
+        popup_text = get_text(lang, 'hunt_quest_count_open', format_str=False).format(open=open_count)
+        text += get_text(lang, 'hunt_quest_count_open').format(open=open_count)
 
     text += "\n\n"
 
@@ -1102,7 +1146,7 @@ def send_next_quest(update: Update, context: CallbackContext):
     row = [InlineKeyboardButton(text=f"{get_emoji('checked')} {get_text(lang, 'quest_collected')}",
                                 callback_data=f'quest_collected {closest_stop_id}')]
 
-    if len(quests_found) > 1 or skipped_quests:
+    if open_count > 1 or skipped_count:
         row.append(InlineKeyboardButton(text=f"{get_emoji('defer')} {get_text(lang, 'quest_skip')}",
                                         callback_data=f'quest_skip {closest_stop_id}'))
     row.append(InlineKeyboardButton(text=f"{get_emoji('trash')} {get_text(lang, 'quest_ignore')}",
@@ -1110,8 +1154,8 @@ def send_next_quest(update: Update, context: CallbackContext):
 
     keyboard = [row]
 
-    if 'skipped_quests' in chat_data:
-        text = f"{get_emoji('enqueue')} {get_text(lang, 'quests_enqueue_skipped')} ({len(skipped_quests)})"
+    if skipped_count:
+        text = f"{get_emoji('enqueue')} {get_text(lang, 'quests_enqueue_skipped')} ({skipped_count})"
         keyboard.append([InlineKeyboardButton(text=text,
                                               callback_data='enqueue_skipped')])
 
@@ -1154,19 +1198,13 @@ def quest_collected(update: Update, context: CallbackContext):
 
     chat_data = context.chat_data
 
-    if 'collected_quests' not in chat_data:
-        chat_data['collected_quests'] = [stop_id]
-    else:
-        chat_data['collected_quests'].append(stop_id)
+    snapshot = get_snapshot()
 
-    # get all quests for chat
-    quests_found = get_all_quests_in_range(chat_data,
-                                           get_area_center_point(chat_data=chat_data),
-                                           get_area_radius(chat_data=chat_data))
+    get_hunt_session(chat_data, snapshot).collect(stop_id)
 
     # update user location
-    if stop_id in quests_found:
-        chat_data['user_location'] = [quests_found[stop_id].latitude, quests_found[stop_id].longitude]
+    if stop_id in snapshot.quests:
+        chat_data['user_location'] = [snapshot.quests[stop_id].latitude, snapshot.quests[stop_id].longitude]
 
     if 'do_not_show_collected_hint' not in chat_data:
         return show_collected_hint(update, context)
@@ -1217,10 +1255,7 @@ def quest_skip(update: Update, context: CallbackContext):
 
     chat_data = context.chat_data
 
-    if 'skipped_quests' not in chat_data:
-        chat_data['skipped_quests'] = [stop_id]
-    else:
-        chat_data['skipped_quests'].append(stop_id)
+    get_hunt_session(chat_data, get_snapshot()).skip(stop_id)
 
     if 'do_not_show_skipped_hint' not in chat_data:
         return show_skipped_hint(update, context)
@@ -1287,10 +1322,7 @@ def quest_ignore(update: Update, context: CallbackContext):
 
         stop_id = params[2]
 
-        if 'ignored_quests' not in chat_data:
-            chat_data['ignored_quests'] = [stop_id]
-        else:
-            chat_data['ignored_quests'].append(stop_id)
+        get_hunt_session(chat_data, get_snapshot()).ignore(stop_id)
 
         return send_next_quest(update, context)
 
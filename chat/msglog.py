@@ -0,0 +1,136 @@
+import logging
+import queue
+import sqlite3
+import time
+
+from threading import Thread
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = ("CREATE TABLE IF NOT EXISTS messages ("
+           "chat_id INTEGER NOT NULL, "
+           "msg_id INTEGER NOT NULL, "
+           "user_id INTEGER, "
+           "logged_at INTEGER NOT NULL, "
+           "PRIMARY KEY (chat_id, msg_id)"
+           ") WITHOUT ROWID",
+           "CREATE INDEX IF NOT EXISTS messages_by_user ON messages (chat_id, user_id, msg_id)",
+           "CREATE INDEX IF NOT EXISTS messages_by_time ON messages (logged_at)",
+           "CREATE TABLE IF NOT EXISTS users ("
+           "chat_id INTEGER NOT NULL, "
+           "user_id INTEGER NOT NULL, "
+           "username TEXT, "
+           "PRIMARY KEY (chat_id, user_id)"
+           ") WITHOUT ROWID")
+
+
+def connect(database):
+    """Open the message log database and create its tables if necessary"""
+    db = sqlite3.connect(database, timeout=30)
+    # readers don't block the writer and the other way round
+    db.execute("PRAGMA journal_mode=WAL")
+    # with WAL, syncing on checkpoints is enough to not corrupt the database
+    db.execute("PRAGMA synchronous=NORMAL")
+    for statement in _SCHEMA:
+        db.execute(statement)
+    db.commit()
+    return db
+
+
+def insert_messages(db, records):
+    """Insert (chat id, message id, user id, username, logged at) records. Known messages are skipped."""
+    db.executemany("INSERT OR IGNORE INTO messages (chat_id, msg_id, user_id, logged_at) VALUES (?, ?, ?, ?)",
+                   [(chat_id, msg_id, user_id, logged_at) for (chat_id, msg_id, user_id, _, logged_at) in records])
+    # latest username of each user. messages without a user (e.g. in channels) have no username
+    usernames = {(chat_id, user_id): username for (chat_id, _, user_id, username, _) in records
+                 if user_id is not None}
+    db.executemany("INSERT OR REPLACE INTO users (chat_id, user_id, username) VALUES (?, ?, ?)",
+                   [(chat_id, user_id, username) for ((chat_id, user_id), username) in usernames.items()])
+
+
+class MessageLog:
+    """Log the ids of all messages per chat and user in a SQLite database without blocking the handlers.
+
+    Handlers only put records into a queue. A background thread inserts them in batches, one transaction at most
+    every flush_interval seconds, and deletes messages older than retention_days every cleanup_interval seconds.
+    """
+
+    def __init__(self, database, flush_interval, cleanup_interval, retention_days):
+        self.database = database
+        self.flush_interval = flush_interval
+        self.cleanup_interval = cleanup_interval
+        self.retention_days = retention_days
+        # (chat id, message id, user id, username, logged at) or None to stop
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def log(self, chat_id, msg_id, user_id, username):
+        """Remember a message. Returns immediately."""
+        self._queue.put((chat_id, msg_id, user_id, username, int(time.time())))
+
+    def start(self):
+        """Start the background writer"""
+        self._thread = Thread(target=self._run, name='message-log', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Write all queued records"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        db = connect(self.database)
+        last_cleanup = None
+        stopped = False
+
+        while not stopped:
+            # wait for the next record, then collect everything that arrives within the flush interval
+            records = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while records[-1] is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    records.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            if records[-1] is None:
+                stopped = True
+                records.pop()
+
+            try:
+                with db:
+                    insert_messages(db, records)
+                if last_cleanup is None or time.monotonic() - last_cleanup >= self.cleanup_interval:
+                    self._clean_up(db)
+                    last_cleanup = time.monotonic()
+            except sqlite3.Error as e:
+                logger.error(f"Failed to write {len(records)} messages to the message log: {e}")
+
+        db.close()
+
+    def _clean_up(self, db):
+        """Delete messages older than the retention window"""
+        if self.retention_days <= 0:
+            return
+        with db:
+            deleted = db.execute("DELETE FROM messages WHERE logged_at < ?",
+                                 (int(time.time()) - self.retention_days * 86400, )).rowcount
+        if deleted:
+            logger.info(f"Deleted {deleted} messages older than {self.retention_days} days from the message log")
+
+    def get_messages(self, chat_id, user_id=None):
+        """Get the ids of all logged messages of a chat, optionally only those of a user"""
+        db = connect(self.database)
+        try:
+            if user_id is None:
+                rows = db.execute("SELECT msg_id FROM messages WHERE chat_id = ? ORDER BY msg_id", (chat_id, ))
+            else:
+                rows = db.execute("SELECT msg_id FROM messages WHERE chat_id = ? AND user_id = ? ORDER BY msg_id",
+                                  (chat_id, user_id))
+            return [msg_id for (msg_id, ) in rows]
+        finally:
+            db.close()
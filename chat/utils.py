@@ -9,7 +9,9 @@ from telegram.error import BadRequest
 from telegram.ext import CallbackContext
 from telegram.utils.promise import Promise
 
-from chat.config import msg_folder, bot_devs
+from chat.config import bot_devs, msg_log_database, msg_log_flush_interval, msg_log_cleanup_interval, \
+    msg_log_retention_days
+from chat.msglog import MessageLog
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +20,12 @@ _languages = []
 
 _bot = None
 
+# ids of all messages per chat, written in the background
+_message_log = MessageLog(database=msg_log_database,
+                          flush_interval=msg_log_flush_interval,
+                          cleanup_interval=msg_log_cleanup_interval,
+                          retention_days=msg_log_retention_days)
+
 
 def load_all_languages():
     """Load all language files"""
@@ -289,42 +297,6 @@ def log_message(func):
     def func_wrapper(update: Update, context: CallbackContext, user_data=None):
         """Wrapper for decorated function"""
 
-        def update_msg_log(chat_id_log, msg_id_log, user_id_log, username_log):
-            """Store all messages for a chat in a file"""
-            data = {}
-            changes_detected = False
-            fn = str(chat_id_log) + '.json'
-            if not os.path.exists(msg_folder):
-                os.makedirs(msg_folder)
-            msg_file = os.path.join(msg_folder, fn)
-            # read message history
-            if os.path.isfile(msg_file):
-                with open(msg_file, 'r') as f:
-                    data = json.load(f)
-            # convert user_id to string to avoid errors
-            user_id_log = str(user_id_log)
-            # init dict for user
-            if user_id_log not in data:
-                data[user_id_log] = {}
-                changes_detected = True
-            # set or update username
-            if 'username' not in data[user_id_log] or data[user_id_log]['username'] != username_log:
-                data[user_id_log]['username'] = username_log
-                changes_detected = True
-            # init message list
-            if 'messages' not in data[user_id_log]:
-                data[user_id_log]['messages'] = []
-                changes_detected = True
-            # store message
-            if msg_id_log not in data[user_id_log]['messages']:
-                data[user_id_log]['messages'].append(msg_id_log)
-                changes_detected = True
-            # save file
-            if changes_detected:
-                with open(msg_file, 'w+') as f:
-                    json.dump(data, f)
-            return
-
         def log_to_logger(update_log, user_id_log, username_log):
             """Unified logger output"""
             chat = update_log.effective_chat
@@ -349,7 +321,7 @@ def log_message(func):
         (chat_id, msg_id, user_id, username) = extract_ids(update)
 
         # log received message
-        update_msg_log(chat_id, msg_id, user_id, username)
+        _message_log.log(chat_id, msg_id, user_id, username)
 
         # log to console
         log_to_logger(update, user_id, username)
@@ -366,7 +338,7 @@ def log_message(func):
             (chat_id, msg_id, user_id, username) = extract_ids(message)
 
             # log sent message
-            update_msg_log(chat_id, msg_id, user_id, username)
+            _message_log.log(chat_id, msg_id, user_id, username)
 
         # return result of wrapped function
         return message
@@ -494,6 +466,21 @@ def job_delete_message(context: CallbackContext):
         logger.warning(f"Failed to delete message #{message_id} in chat #{chat_id}: {e}")
 
 
+def start_message_log():
+    """Start writing logged messages to disk"""
+    _message_log.start()
+
+
+def stop_message_log():
+    """Write all logged messages to disk"""
+    _message_log.stop()
+
+
+def get_logged_messages(chat_id, user_id=None):
+    """Get the ids of all logged messages of a chat, optionally only those of a user"""
+    return _message_log.get_messages(chat_id, user_id)
+
+
 def set_bot(bot):
     """Remember a reference to the bot instance."""
     global _bot
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""Compare reward and range filtering of the columnar quest store with a linear scan over all quests.
+
+Usage: python3 misc/benchmark_columnar_store.py [quest_count] [query_count]
+"""
+import os
+import random
+import sys
+import timeit
+
+from geopy.distance import great_circle
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# chat has to be imported before quest because of their circular imports
+import chat  # noqa: E402,F401
+from benchmark_quest_grid import CENTER, SPREAD, RADIUS, create_quests  # noqa: E402
+from quest.columnar import ColumnarQuestStore  # noqa: E402
+
+CHAT_DATA = {'pokemon': [1, 4, 7], 'items': [701], 'tasks': []}
+
+
+def scan(quests, chat_data, center_point, radius):
+    """Linear scan as done by quest.data.get_all_quests_in_range without columnar store"""
+    return {stop_id for stop_id, quest in quests.items()
+            if (quest.pokemon_id in chat_data['pokemon'] or quest.item_id in chat_data['items'] or
+                quest.task_id in chat_data['tasks']) and
+            great_circle(center_point, [quest.latitude, quest.longitude]).meters <= radius}
+
+
+def main():
+    quest_count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    query_count = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    random.seed(42)
+    quests = create_quests(quest_count)
+
+    build_time = timeit.timeit(lambda: ColumnarQuestStore(quests), number=1)
+    store = ColumnarQuestStore(quests)
+
+    centers = [(CENTER[0] + random.uniform(-SPREAD, SPREAD), CENTER[1] + random.uniform(-SPREAD, SPREAD))
+               for _ in range(query_count)]
+
+    for center_point in centers:
+        assert scan(quests, CHAT_DATA, center_point, RADIUS) == \
+               store.get_all_quests_in_range(CHAT_DATA, center_point, RADIUS).keys()
+
+    scan_time = timeit.timeit(lambda: [scan(quests, CHAT_DATA, c, RADIUS) for c in centers],
+                              number=1) / query_count
+    store_time = timeit.timeit(lambda: [store.get_all_quests_in_range(CHAT_DATA, c, RADIUS) for c in centers],
+                               number=1) / query_count
+
+    print(f"quests: {quest_count}, queries: {query_count}, radius: {RADIUS} m")
+    print(f"store build:    {build_time * 1000:8.2f} ms")
+    print(f"linear scan:    {scan_time * 1000:8.2f} ms / query")
+    print(f"columnar query: {store_time * 1000:8.2f} ms / query ({scan_time / store_time:.1f}x faster)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""Compare range queries on the quest grid with a linear scan over all quests.
+
+Usage: python3 misc/benchmark_quest_grid.py [quest_count] [query_count]
+"""
+import os
+import random
+import sys
+import timeit
+
+from geopy.distance import great_circle
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# chat has to be imported before quest because of their circular imports
+import chat  # noqa: E402,F401
+from quest.grid import QuestGrid  # noqa: E402
+from quest.quest import Quest  # noqa: E402
+
+# area the random quests are spread across (roughly 50 x 50 km)
+CENTER = (52.52, 13.40)
+SPREAD = 0.25
+RADIUS = 2500
+
+
+def create_quests(count):
+    """Create random quests around the center"""
+    quests = {}
+    for i in range(count):
+        stop_id = f"stop{i}"
+        quests[stop_id] = Quest(stop_id=stop_id,
+                                stop_name=f"Stop {i}",
+                                latitude=CENTER[0] + random.uniform(-SPREAD, SPREAD),
+                                longitude=CENTER[1] + random.uniform(-SPREAD, SPREAD),
+                                timestamp=0,
+                                pokemon_id=random.randint(0, 20),
+                                item_id=random.choice([0, 1, 2, 701, 705]),
+                                item_amount=1,
+                                task_id="TASK")
+    return quests
+
+
+def scan(quests, center_point, radius):
+    """Linear scan as done before the grid existed"""
+    return {stop_id for stop_id, quest in quests.items()
+            if great_circle(center_point, [quest.latitude, quest.longitude]).meters <= radius}
+
+
+def grid_query(grid, quests, center_point, radius):
+    """Range query using the grid"""
+    return {stop_id for stop_id in grid.get_stop_ids_in_range(center_point, radius)
+            if great_circle(center_point, [quests[stop_id].latitude, quests[stop_id].longitude]).meters <= radius}
+
+
+def main():
+    quest_count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    query_count = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    random.seed(42)
+    quests = create_quests(quest_count)
+
+    grid = QuestGrid()
+    build_time = timeit.timeit(lambda: [grid.add(q.stop_id, q.latitude, q.longitude) for q in quests.values()],
+                               number=1)
+
+    centers = [(CENTER[0] + random.uniform(-SPREAD, SPREAD), CENTER[1] + random.uniform(-SPREAD, SPREAD))
+               for _ in range(query_count)]
+
+    for center_point in centers:
+        assert scan(quests, center_point, RADIUS) == grid_query(grid, quests, center_point, RADIUS)
+
+    scan_time = timeit.timeit(lambda: [scan(quests, c, RADIUS) for c in centers], number=1) / query_count
+    grid_time = timeit.timeit(lambda: [grid_query(grid, quests, c, RADIUS) for c in centers], number=1) / query_count
+
+    print(f"quests: {quest_count}, queries: {query_count}, radius: {RADIUS} m")
+    print(f"grid build:  {build_time * 1000:8.2f} ms")
+    print(f"linear scan: {scan_time * 1000:8.2f} ms / query")
+    print(f"grid query:  {grid_time * 1000:8.2f} ms / query ({scan_time / grid_time:.1f}x faster)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""Measure the memory used per quest by the slotted quest class compared to a plain class with a __dict__.
+
+Every quest gets its own copies of the stop name and task strings, just like rows fetched from the database.
+
+Usage: python3 misc/benchmark_quest_memory.py [quest_count ...]
+"""
+import gc
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# chat has to be imported before quest because of their circular imports
+import chat  # noqa: E402,F401
+from quest.quest import Quest  # noqa: E402
+
+TASKS = ["CHALLENGE_CATCH_EASY", "CHALLENGE_LAND_EXCELLENT_CURVEBALL", "CHALLENGE_HATCH_EGG", "CHALLENGE_RAID_EASY",
+         "CHALLENGE_EVOLVE_FAMILY_MAGIKARP", "CHALLENGE_SEND_GIFT", "CHALLENGE_USE_BERRY_EASY"]
+
+
+class DictQuest:
+    """Quest as it used to be stored, with a __dict__ per instance and without interned strings"""
+
+    def __init__(self, stop_id, stop_name, latitude, longitude, timestamp, pokemon_id, item_id, item_amount, task_id):
+        self.stop_id = stop_id
+        self.stop_name = stop_name
+        self.latitude = latitude
+        self.longitude = longitude
+        self.timestamp = timestamp
+        self.pokemon_id = pokemon_id
+        self.item_id = item_id
+        self.item_amount = item_amount
+        self.task_id = task_id
+
+
+def create_rows(count):
+    """Create rows with a few hundred distinct stop names and tasks, each row with its own string objects"""
+    names = [f"Pokestop {i}" for i in range(500)]
+    return [(f"{i:032x}.16",
+             random.choice(names),
+             52.52 + random.uniform(-0.25, 0.25),
+             13.40 + random.uniform(-0.25, 0.25),
+             1600000000.0 + i,
+             random.randint(0, 20),
+             random.choice([0, 1, 2, 701, 705]),
+             1,
+             random.choice(TASKS))
+            for i in range(count)]
+
+
+def measure(quest_class, rows):
+    """Get the bytes allocated per quest when creating one quest for every row"""
+    gc.collect()
+    tracemalloc.start()
+    # copying the strings like the database driver does is part of the measurement
+    quests = {row[0]: quest_class(row[0], row[1].encode().decode(), *row[2:8], row[8].encode().decode())
+              for row in rows}
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del quests
+    return size / len(rows)
+
+
+def main():
+    counts = [int(count) for count in sys.argv[1:]] or [10000, 100000, 1000000]
+
+    print(f"{'quests':>10} {'dict class':>14} {'slots class':>14} {'saved':>8}")
+    for count in counts:
+        rows = create_rows(count)
+        dict_size = measure(DictQuest, rows)
+        slots_size = measure(Quest, rows)
+        print(f"{count:>10} {dict_size:>8.0f} B/quest {slots_size:>8.0f} B/quest {1 - slots_size / dict_size:>8.0%}")
+
+
+if __name__ == '__main__':
+    main()
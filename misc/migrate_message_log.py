@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""Import the message_log folder with one JSON file per chat into the message log database.
+
+Files are read one at a time and inserted in batches, so the folder can be larger than the available memory. Running
+the import twice doesn't duplicate messages.
+
+Usage: python3 misc/migrate_message_log.py [message_log folder] [database]
+"""
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# chat has to be imported before quest because of their circular imports
+import chat  # noqa: E402,F401
+from chat.config import msg_folder, msg_log_database  # noqa: E402
+from chat.msglog import connect, insert_messages  # noqa: E402
+
+BATCH_SIZE = 10000
+
+
+def read_records(folder):
+    """Yield (chat id, message id, user id, username, logged at) for all messages in the folder"""
+    for file_name in sorted(os.listdir(folder)):
+        if not file_name.endswith('.json'):
+            continue
+        file_path = os.path.join(folder, file_name)
+        try:
+            chat_id = int(file_name[:-len('.json')])
+            with open(file_path, 'r') as f:
+                data = json.load(f)
+        except ValueError as e:
+            print(f"skipping {file_path}: {e}")
+            continue
+
+        # the files don't know when a message was sent, so the last change of the file has to do
+        logged_at = int(os.path.getmtime(file_path))
+        for user_id, user in data.items():
+            user_id = None if user_id == 'None' else int(user_id)
+            for msg_id in user.get('messages', []):
+                yield chat_id, msg_id, user_id, user.get('username'), logged_at
+
+
+def main():
+    folder = sys.argv[1] if len(sys.argv) > 1 else msg_folder
+    database = sys.argv[2] if len(sys.argv) > 2 else msg_log_database
+
+    db = connect(database)
+    count = 0
+    batch = []
+    for record in read_records(folder):
+        batch.append(record)
+        if len(batch) >= BATCH_SIZE:
+            with db:
+                insert_messages(db, batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        with db:
+            insert_messages(db, batch)
+        count += len(batch)
+    db.close()
+
+    print(f"imported {count} messages from {folder} into {database}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""Stand-in for MAD that posts quest webhooks to the bot's webhook receiver and reports the ingest latency.
+
+Recorded payloads are read from a file with one JSON payload (a list of webhook events) per line. Without a file,
+random quests are generated.
+
+Usage: python3 misc/replay_webhooks.py [--url URL] [--file FILE] [--count N] [--batch-size N] [--rate N]
+                                        [--threads N]
+"""
+import argparse
+import json
+import random
+import time
+import urllib.request
+
+from concurrent.futures import ThreadPoolExecutor
+
+# area the random quests are spread across (roughly 50 x 50 km)
+CENTER = (52.52, 13.40)
+SPREAD = 0.25
+
+
+def create_payloads(count, batch_size):
+    """Create payloads with random quests in the format MAD uses for quest webhooks"""
+    payloads = []
+    for i in range(count):
+        events = []
+        for j in range(batch_size):
+            stop_number = random.randint(0, 50000)
+            events.append({'type': 'quest',
+                           'message': {'pokestop_id': f"stop{stop_number}",
+                                       'name': f"Stop {stop_number}",
+                                       'latitude': CENTER[0] + random.uniform(-SPREAD, SPREAD),
+                                       'longitude': CENTER[1] + random.uniform(-SPREAD, SPREAD),
+                                       'timestamp': int(time.time()),
+                                       'pokemon_id': random.randint(0, 20),
+                                       'item_id': random.choice([0, 1, 2, 701, 705]),
+                                       'item_amount': 1,
+                                       'quest_reward_type_raw': 2,
+                                       'quest_template': "CHALLENGE_CATCH_EASY"}})
+        payloads.append(events)
+    return payloads
+
+
+def load_payloads(file_name):
+    """Load recorded payloads, one JSON payload per line"""
+    with open(file=file_name, mode='r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def post(url, payload):
+    """Post a payload and return the round trip time in seconds"""
+    data = json.dumps(payload).encode('utf-8')
+    request = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    start = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=10) as response:
+        response.read()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Post quest webhooks to the bot")
+    parser.add_argument('--url', default='http://127.0.0.1:8700/')
+    parser.add_argument('--file', help="file with recorded payloads, one per line")
+    parser.add_argument('--count', type=int, default=1000, help="number of random payloads")
+    parser.add_argument('--batch-size', type=int, default=10, help="quests per random payload")
+    parser.add_argument('--rate', type=float, default=0, help="payloads per second, 0 for as fast as possible")
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    payloads = load_payloads(args.file) if args.file else create_payloads(args.count, args.batch_size)
+    quest_count = sum(len(payload) if isinstance(payload, list) else 1 for payload in payloads)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        futures = []
+        for i, payload in enumerate(payloads):
+            if args.rate:
+                # keep the requested rate
+                delay = start + i / args.rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            futures.append(executor.submit(post, args.url, payload))
+        round_trips = sorted(future.result() for future in futures)
+    duration = time.perf_counter() - start
+
+    print(f"posted {len(payloads)} payloads with {quest_count} quests in {duration:.2f} s "
+          f"({len(payloads) / duration:.0f} payloads/s, {quest_count / duration:.0f} quests/s)")
+    print(f"request round trip: median {round_trips[len(round_trips) // 2] * 1000:.1f} ms, "
+          f"p99 {round_trips[int(len(round_trips) * 0.99)] * 1000:.1f} ms")
+
+    # give the bot a moment to publish the last batch
+    time.sleep(0.5)
+    with urllib.request.urlopen(args.url.rstrip('/') + '/stats', timeout=10) as response:
+        stats = json.loads(response.read())
+    print(f"bot: {stats['received']} received, {stats['accepted']} accepted, {stats['rejected']} rejected "
+          f"in {stats['batches']} batches")
+    print(f"ingest latency (received until published): average {stats['latency_avg'] * 1000:.1f} ms, "
+          f"max {stats['latency_max'] * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+from collections import OrderedDict, defaultdict
+from threading import Lock
+
+from geopy.distance import great_circle
+
+from quest.expiry import is_expired
+
+# with more changes it is cheaper to drop all entries than to patch them
+MAX_CARRY_FORWARD_CHANGES = 2000
+
+
+class QuestRangeCache:
+    """Bounded LRU cache for the quests a user can hunt, keyed by snapshot version, day, area and rewards"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def get_selection(chat_data, center_point, radius):
+        """Get the area and rewards a user chose. Changing the area or any reward results in a different selection."""
+        pokemon = frozenset(chat_data['pokemon']) if 'pokemon' in chat_data else frozenset()
+        items = frozenset(chat_data['items']) if 'items' in chat_data else frozenset()
+        tasks = frozenset(chat_data['tasks']) if 'tasks' in chat_data else frozenset()
+        return tuple(center_point), radius, pokemon, items, tasks
+
+    @staticmethod
+    def get_key(version, start_of_day, chat_data, center_point, radius):
+        """Get the cache key for a query. Results of previous days are never used as their quests expired."""
+        return (version, start_of_day) + QuestRangeCache.get_selection(chat_data, center_point, radius)
+
+    def get(self, key):
+        """Get a cached result or None"""
+        with self._lock:
+            quests_found = self._entries.get(key)
+            if quests_found is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return quests_found
+
+    def put(self, key, quests_found):
+        """Cache a result and evict the least recently used entry if the cache is full"""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = quests_found
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def carry_forward(self, version, new_version, changes):
+        """Move the entries of a snapshot version to the next version and drop all others.
+
+        changes maps stop ids to (old quest or None, new quest or None). Only entries whose area and rewards match a
+        changed quest are patched, all other entries are kept as they are.
+        """
+        if len(changes) > MAX_CARRY_FORWARD_CHANGES:
+            with self._lock:
+                self._entries = OrderedDict()
+            return
+
+        # stop ids of changed quests by reward and task
+        changed_by_pokemon = defaultdict(set)
+        changed_by_item = defaultdict(set)
+        changed_by_task = defaultdict(set)
+        for stop_id, (old_quest, new_quest) in changes.items():
+            for quest in (old_quest, new_quest):
+                if quest is not None:
+                    changed_by_pokemon[quest.pokemon_id].add(stop_id)
+                    changed_by_item[quest.item_id].add(stop_id)
+                    changed_by_task[quest.task_id].add(stop_id)
+
+        with self._lock:
+            entries = OrderedDict()
+            for key, quests_found in self._entries.items():
+                if key[0] != version:
+                    continue
+                (_, start_of_day, center_point, radius, pokemon, items, tasks) = key
+
+                affected = set()
+                for changed, rewards in ((changed_by_pokemon, pokemon), (changed_by_item, items),
+                                         (changed_by_task, tasks)):
+                    for reward in rewards:
+                        if reward in changed:
+                            affected |= changed[reward]
+
+                if affected:
+                    quests_found = dict(quests_found)
+                    for stop_id in affected:
+                        quests_found.pop(stop_id, None)
+                        new_quest = changes[stop_id][1]
+                        if new_quest is not None and not is_expired(new_quest, start_of_day) and \
+                                (new_quest.pokemon_id in pokemon or new_quest.item_id in items or
+                                 new_quest.task_id in tasks) and \
+                                great_circle(center_point, [new_quest.latitude, new_quest.longitude]).meters <= radius:
+                            quests_found[stop_id] = new_quest
+
+                entries[(new_version, ) + key[1:]] = quests_found
+            self._entries = entries
+
+    def get_stats(self):
+        """Get counters for monitoring"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self._entries),
+                    'max_size': self.max_size,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else 0.0}
@@ -0,0 +1,85 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from quest.grid import EARTH_RADIUS
+
+
+def haversine(latitude, longitude, latitudes, longitudes):
+    """Great circle distance in meters from one location to many locations. Coordinates must be in radians."""
+    a = np.sin((latitudes - latitude) / 2) ** 2 + \
+        np.cos(latitude) * np.cos(latitudes) * np.sin((longitudes - longitude) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class ColumnarQuestStore:
+    """Read only copy of all quests in parallel numpy arrays for vectorized filtering"""
+
+    def __init__(self, quests):
+        if np is None:
+            raise RuntimeError("The columnar quest store requires numpy. Install it by running `pip install numpy`.")
+
+        quest_list = list(quests.values())
+
+        # task id => integer code
+        self._task_codes = {}
+        for quest in quest_list:
+            self._task_codes.setdefault(quest.task_id, len(self._task_codes))
+
+        self._quests = quest_list
+        self.stop_ids = [quest.stop_id for quest in quest_list]
+        self.latitudes = np.radians(np.fromiter((quest.latitude for quest in quest_list), dtype=np.float64,
+                                                count=len(quest_list)))
+        self.longitudes = np.radians(np.fromiter((quest.longitude for quest in quest_list), dtype=np.float64,
+                                                 count=len(quest_list)))
+        self.timestamps = np.fromiter((quest.timestamp for quest in quest_list), dtype=np.int64,
+                                      count=len(quest_list))
+        self.pokemon_ids = np.fromiter((quest.pokemon_id for quest in quest_list), dtype=np.int32,
+                                       count=len(quest_list))
+        self.item_ids = np.fromiter((quest.item_id for quest in quest_list), dtype=np.int32, count=len(quest_list))
+        self.task_codes = np.fromiter((self._task_codes[quest.task_id] for quest in quest_list), dtype=np.int32,
+                                      count=len(quest_list))
+
+    def __len__(self):
+        return len(self._quests)
+
+    def get_reward_mask(self, chat_data):
+        """Get a mask of all quests with a reward or task the user chose"""
+        pokemon = list(chat_data['pokemon']) if 'pokemon' in chat_data else []
+        items = list(chat_data['items']) if 'items' in chat_data else []
+        tasks = chat_data['tasks'] if 'tasks' in chat_data else []
+        tasks = [self._task_codes[task_id] for task_id in tasks if task_id in self._task_codes]
+
+        return np.isin(self.pokemon_ids, pokemon) | np.isin(self.item_ids, items) | np.isin(self.task_codes, tasks)
+
+    def get_all_quests_in_range(self, chat_data, center_point, radius, start_of_day=None):
+        """Get all quests that the user chose within a radius to a point. Skips quests scanned before start_of_day."""
+        mask = self.get_reward_mask(chat_data)
+        if start_of_day is not None:
+            mask &= self.timestamps >= start_of_day
+        indices = np.flatnonzero(mask)
+        if not len(indices):
+            return {}
+
+        distances = haversine(np.radians(center_point[0]), np.radians(center_point[1]),
+                              self.latitudes[indices], self.longitudes[indices])
+
+        return {self.stop_ids[i]: self._quests[i] for i in indices[distances <= radius]}
+
+    @staticmethod
+    def get_closest_quest(quests_found, current_location):
+        """Get quest that is closest to a given location"""
+        if not quests_found:
+            return None, None
+
+        stop_ids = list(quests_found)
+        latitudes = np.radians(np.fromiter((quests_found[stop_id].latitude for stop_id in stop_ids),
+                                           dtype=np.float64, count=len(stop_ids)))
+        longitudes = np.radians(np.fromiter((quests_found[stop_id].longitude for stop_id in stop_ids),
+                                            dtype=np.float64, count=len(stop_ids)))
+
+        distances = haversine(np.radians(current_location[0]), np.radians(current_location[1]), latitudes, longitudes)
+        closest = int(np.argmin(distances))
+
+        return float(distances[closest]), stop_ids[closest]
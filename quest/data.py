@@ -1,21 +1,29 @@
 import json
 import os
+from contextlib import contextmanager
+from threading import Lock
 
 from geopy.distance import great_circle
 
+from chat.config import quests_use_columnar_store, quests_range_cache_size
 from chat.utils import get_text
 
-quests = {}
+from quest.cache import QuestRangeCache
+from quest.expiry import get_start_of_day, is_expired
+from quest.nearest import QuestTree
+from quest.snapshot import QuestSnapshot, QuestSnapshotBuilder
 
-# list of all available quests
-quest_pokemon_list = []
-quest_items_list = []
+# current snapshot of all quests. readers must fetch it once per operation through get_snapshot()
+_snapshot = QuestSnapshot.empty()
+# ensures only one new snapshot is built at a time
+_snapshot_lock = Lock()
+
+# quests in range per area and rewards of a user
+_range_cache = QuestRangeCache(max_size=quests_range_cache_size)
 
 # dict of quests and their location (quest_id => location
 quest_locations = {}
 
-shiny_pokemon_list = []
-
 _items = {}
 _item_code_names = {}
 _pokemon = {}
@@ -145,24 +153,100 @@ def get_all_tasks(lang):
     return _tasks[lang]
 
 
-def get_all_quests_in_range(chat_data, center_point, radius):
-    """Get all quests that the user chose within a radius to a point"""
+def get_snapshot():
+    """Get the current snapshot of all quests"""
+    return _snapshot
+
+
+@contextmanager
+def edit_quests():
+    """Build a new snapshot based on the current one and publish it once the block finished without errors"""
+    global _snapshot
+    with _snapshot_lock:
+        builder = QuestSnapshotBuilder(_snapshot, use_columnar_store=quests_use_columnar_store)
+        yield builder
+        snapshot = builder.build()
+        # nothing changed
+        if snapshot is _snapshot:
+            return
+        # keep cached results that are not affected by the changes
+        _range_cache.carry_forward(_snapshot.version, snapshot.version, builder.get_changes())
+        # replace the snapshot with a single assignment so readers always see a consistent state
+        _snapshot = snapshot
+
+
+def get_quest_count():
+    """Get the number of quests that have not expired"""
+    return get_snapshot().count_quests(get_start_of_day())
+
+
+def get_range_cache_stats():
+    """Get hit / miss counters of the quests in range cache"""
+    return _range_cache.get_stats()
+
+
+def get_all_quests_in_range(chat_data, center_point, radius, snapshot=None):
+    """Get all quests that the user chose within a radius to a point. Uses the current snapshot if none is given.
+    Expired quests that have not been removed from the snapshot yet are left out."""
+    if snapshot is None:
+        snapshot = get_snapshot()
+    start_of_day = get_start_of_day()
+
+    key = QuestRangeCache.get_key(snapshot.version, start_of_day, chat_data, center_point, radius)
+    quests_found = _range_cache.get(key)
+    if quests_found is None:
+        quests_found = _find_quests_in_range(snapshot, chat_data, center_point, radius, start_of_day)
+        _range_cache.put(key, quests_found)
+
+    # callers are free to modify the result
+    return dict(quests_found)
+
+
+def _find_quests_in_range(snapshot, chat_data, center_point, radius, start_of_day):
+    """Find all quests that the user chose within a radius to a point in a snapshot and have not expired"""
+    if snapshot.columnar_store is not None:
+        return snapshot.columnar_store.get_all_quests_in_range(chat_data, center_point, radius, start_of_day)
+
     quests_found = {}
 
     pokemon = chat_data['pokemon'] if 'pokemon' in chat_data else []
     items = chat_data['items'] if 'items' in chat_data else []
     tasks = chat_data['tasks'] if 'tasks' in chat_data else []
 
-    for stop_id, quest in quests.items():
-        if quest.pokemon_id in pokemon or quest.item_id in items or quest.task_id in tasks:
-            if great_circle(center_point, [quest.latitude, quest.longitude]).meters <= radius:
-                quests_found[stop_id] = quest
+    # get all stops with a reward or task the user chose
+    candidates = set()
+    for index, keys in ((snapshot.pokemon_index, pokemon), (snapshot.item_index, items), (snapshot.task_index, tasks)):
+        for key in keys:
+            if key in index:
+                candidates.update(index[key])
+
+    if not candidates:
+        return quests_found
+
+    # only check candidates in grid cells that overlap with the area unless there are fewer candidates in total
+    if len(candidates) > snapshot.grid.count_stop_ids_in_range(center_point, radius):
+        candidates = [stop_id for stop_id in snapshot.grid.get_stop_ids_in_range(center_point, radius)
+                      if stop_id in candidates]
+
+    for stop_id in candidates:
+        quest = snapshot.quests[stop_id]
+        if not is_expired(quest, start_of_day) and \
+                great_circle(center_point, [quest.latitude, quest.longitude]).meters <= radius:
+            quests_found[stop_id] = quest
 
     return quests_found
 
 
 def get_closest_quest(quests_found, current_location):
-    """Get quest that is closest to a given location"""
+    """Get quest that is closest to a given location. Quests can be passed as dict or as QuestTree."""
+    if isinstance(quests_found, QuestTree):
+        closest = quests_found.get_closest(current_location)
+        return closest[0] if closest else (None, None)
+
+    columnar_store = get_snapshot().columnar_store
+    if columnar_store is not None:
+        return columnar_store.get_closest_quest(quests_found, current_location)
+
     closest_distance = None
     closest_stop_id = None
 
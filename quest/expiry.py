@@ -0,0 +1,31 @@
+import logging
+
+from datetime import datetime, time
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:
+    ZoneInfo = None
+
+from chat.config import quests_timezone
+
+logger = logging.getLogger(__name__)
+
+# quests expire at midnight in this timezone. None means the local timezone of the server
+_timezone = None
+if quests_timezone:
+    if ZoneInfo is None:
+        logger.warning(f"Time zone {quests_timezone} requires Python 3.9 or later. Using local time instead.")
+    else:
+        _timezone = ZoneInfo(quests_timezone)
+
+
+def get_start_of_day(timestamp=None):
+    """Get the timestamp of the last midnight before a timestamp (or now). Quests scanned before it are expired."""
+    now = datetime.fromtimestamp(timestamp, tz=_timezone) if timestamp is not None else datetime.now(tz=_timezone)
+    return datetime.combine(now.date(), time.min, tzinfo=now.tzinfo).timestamp()
+
+
+def is_expired(quest, start_of_day):
+    """Whether a quest was scanned before the start of the current day"""
+    return quest.timestamp < start_of_day
@@ -0,0 +1,122 @@
+import math
+
+# mean earth radius in meters as used by geopy's great_circle
+EARTH_RADIUS = 6371009
+
+# default edge length of a grid cell in degrees (roughly 1.1 km in north-south direction)
+DEFAULT_CELL_SIZE = 0.01
+
+
+class QuestGrid:
+    """Spatial index that buckets stops into fixed latitude / longitude cells"""
+
+    def __init__(self, cell_size=DEFAULT_CELL_SIZE):
+        self.cell_size = cell_size
+        self._columns = math.ceil(360 / cell_size)
+        # cell => set of stop ids
+        self._cells = {}
+        # stop id => cell
+        self._stop_cells = {}
+        # cells whose set of stop ids may be shared with another grid
+        self._shared_cells = set()
+
+    def __len__(self):
+        return len(self._stop_cells)
+
+    def __contains__(self, stop_id):
+        return stop_id in self._stop_cells
+
+    def copy(self):
+        """Get a copy of this grid. Sets of stop ids are shared until either grid modifies them."""
+        grid = QuestGrid(self.cell_size)
+        grid._cells = dict(self._cells)
+        grid._stop_cells = dict(self._stop_cells)
+        grid._shared_cells = set(self._cells)
+        self._shared_cells = set(self._cells)
+        return grid
+
+    def _get_cell(self, latitude, longitude):
+        """Get the cell a location belongs to"""
+        row = math.floor((latitude + 90) / self.cell_size)
+        column = math.floor((longitude + 180) / self.cell_size) % self._columns
+        return row, column
+
+    def add(self, stop_id, latitude, longitude):
+        """Add a stop to the grid or move it if its location changed"""
+        cell = self._get_cell(latitude, longitude)
+        old_cell = self._stop_cells.get(stop_id)
+        if old_cell == cell:
+            return
+        if old_cell is not None:
+            self._discard_from_cell(stop_id, old_cell)
+        if cell in self._shared_cells:
+            self._cells[cell] = set(self._cells[cell])
+            self._shared_cells.discard(cell)
+        self._cells.setdefault(cell, set()).add(stop_id)
+        self._stop_cells[stop_id] = cell
+
+    def remove(self, stop_id):
+        """Remove a stop from the grid"""
+        cell = self._stop_cells.pop(stop_id, None)
+        if cell is not None:
+            self._discard_from_cell(stop_id, cell)
+
+    def _discard_from_cell(self, stop_id, cell):
+        if cell in self._shared_cells:
+            self._cells[cell] = set(self._cells[cell])
+            self._shared_cells.discard(cell)
+        stop_ids = self._cells[cell]
+        stop_ids.discard(stop_id)
+        if not stop_ids:
+            del self._cells[cell]
+
+    def clear(self):
+        """Remove all stops"""
+        self._cells = {}
+        self._stop_cells = {}
+        self._shared_cells = set()
+
+    def _get_cells_in_range(self, center_point, radius):
+        """Get all cells that overlap with the bounding box of a circle"""
+        latitude, longitude = center_point
+        # angular radius of the circle
+        angle = radius / EARTH_RADIUS
+
+        min_latitude = latitude - math.degrees(angle)
+        max_latitude = latitude + math.degrees(angle)
+
+        min_row = math.floor((max(min_latitude, -90) + 90) / self.cell_size)
+        max_row = math.floor((min(max_latitude, 90) + 90) / self.cell_size)
+
+        # circle contains a pole or is too large, so every column is affected
+        if min_latitude <= -90 or max_latitude >= 90 or math.sin(angle) >= math.cos(math.radians(latitude)):
+            columns = range(self._columns)
+        else:
+            # maximum longitude difference of a point on the circle
+            delta_longitude = math.degrees(math.asin(math.sin(angle) / math.cos(math.radians(latitude))))
+            min_column = math.floor((longitude - delta_longitude + 180) / self.cell_size)
+            max_column = math.floor((longitude + delta_longitude + 180) / self.cell_size)
+            if max_column - min_column + 1 >= self._columns:
+                columns = range(self._columns)
+            else:
+                columns = [column % self._columns for column in range(min_column, max_column + 1)]
+
+        # don't probe more cells than there are occupied ones
+        if (max_row - min_row + 1) * len(columns) > len(self._cells):
+            columns = set(columns)
+            return [cell for cell in self._cells if min_row <= cell[0] <= max_row and cell[1] in columns]
+
+        return [(row, column) for row in range(min_row, max_row + 1) for column in columns]
+
+    def get_stop_ids_in_range(self, center_point, radius):
+        """Get ids of all stops in cells that overlap a circle. Stops might be outside the circle."""
+        stop_ids = []
+        for cell in self._get_cells_in_range(center_point, radius):
+            if cell in self._cells:
+                stop_ids.extend(self._cells[cell])
+        return stop_ids
+
+    def count_stop_ids_in_range(self, center_point, radius):
+        """Count the stops get_stop_ids_in_range would return without collecting them"""
+        return sum(len(self._cells[cell]) for cell in self._get_cells_in_range(center_point, radius)
+                   if cell in self._cells)
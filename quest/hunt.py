@@ -0,0 +1,290 @@
+import time
+
+from collections import deque
+from geopy.distance import great_circle
+
+from quest.nearest import QuestTree, to_unit_vector
+from quest.route import DEFAULT_MAX_STOPS, DEFAULT_TIME_BUDGET, get_insert_position, plan_route
+
+
+def _iter_ordinals(bits):
+    """Iterate over the positions of all set bits"""
+    while bits:
+        lowest = bits & -bits
+        yield lowest.bit_length() - 1
+        bits ^= lowest
+
+
+class StopIdBitset:
+    """Read-only set of stop ids backed by a bitset over the stop ordinals of a hunt session"""
+
+    __slots__ = ('_stop_ids', '_ordinals', 'bits')
+
+    def __init__(self, stop_ids, ordinals, bits):
+        self._stop_ids = stop_ids
+        self._ordinals = ordinals
+        self.bits = bits
+
+    def __contains__(self, stop_id):
+        ordinal = self._ordinals.get(stop_id)
+        return ordinal is not None and (self.bits >> ordinal) & 1 == 1
+
+    def __iter__(self):
+        return (self._stop_ids[ordinal] for ordinal in _iter_ordinals(self.bits))
+
+    def __len__(self):
+        return bin(self.bits).count('1')
+
+    def __bool__(self):
+        return self.bits != 0
+
+
+class HuntSession:
+    """State of a quest hunt that is updated step by step instead of being recomputed on every click.
+
+    The session is persisted with the chat data, so it only keeps stop ids. Every stop id is stored once and gets an
+    ordinal within the session. The state of the stops is kept in bitsets over these ordinals. Quest objects are
+    looked up in the snapshot whose unique version the session was last synced with. Quests missing from that snapshot
+    are treated as removed.
+    """
+
+    def __init__(self, quests_found, version, collected=(), skipped=(), ignored=(), selection=None,
+                 start_of_day=None):
+        self.version = version
+        # area and rewards the candidates were found with
+        self.selection = selection
+        # quests scanned before this time were left out of the candidates as they expired
+        self.start_of_day = start_of_day
+        # ordinal => stop id of all stops the session has seen
+        self._stop_ids = []
+        # stop id => ordinal
+        self._ordinals = {}
+        # stops of all quests the user chose within the area
+        self._candidates = self._encode(quests_found)
+        self._collected = self._encode(collected)
+        self._ignored = self._encode(ignored)
+        # skipped candidates that have been neither collected nor ignored
+        self._skipped = self._encode(skipped) & self._candidates & ~self._collected & ~self._ignored
+        # candidates that still need to be visited
+        self._remaining = self._candidates & ~self._collected & ~self._ignored & ~self._skipped
+        # planned order of the ordinals of the remaining quests. None if the route is not planned ahead
+        self.route = None
+        # (time budget, max stops) the route was planned with, also used when quests are added to the route
+        self._route_limits = (DEFAULT_TIME_BUDGET, DEFAULT_MAX_STOPS)
+        # kd-tree of the remaining quests, built on demand
+        self._tree = None
+
+    def __getstate__(self):
+        # the ordinals and the tree can be rebuilt at any time and are not worth persisting
+        return {'version': self.version,
+                'selection': self.selection,
+                'start_of_day': self.start_of_day,
+                'stop_ids': self._stop_ids,
+                'candidates': self._candidates,
+                'collected': self._collected,
+                'ignored': self._ignored,
+                'skipped': self._skipped,
+                'route': list(self.route) if self.route is not None else None,
+                'route_limits': self._route_limits}
+
+    def __setstate__(self, state):
+        if 'stop_ids' not in state:
+            # sessions of previous versions kept sets of stop ids
+            self.__init__(quests_found=state['candidates'],
+                          version=state['version'],
+                          collected=state['collected'],
+                          skipped=state['skipped'],
+                          ignored=state['ignored'])
+            if state.get('route') is not None:
+                self.route = deque(self._ordinals[stop_id] for stop_id in state['route'] if stop_id in self._ordinals)
+            return
+
+        self.version = state['version']
+        # sessions without a selection are synced with the current selection when they are used next
+        self.selection = state.get('selection')
+        self.start_of_day = state.get('start_of_day')
+        self._stop_ids = state['stop_ids']
+        self._ordinals = {stop_id: ordinal for ordinal, stop_id in enumerate(self._stop_ids)}
+        self._candidates = state['candidates']
+        self._collected = state['collected']
+        self._ignored = state['ignored']
+        self._skipped = state['skipped']
+        self._remaining = self._candidates & ~self._collected & ~self._ignored & ~self._skipped
+        self.route = deque(state['route']) if state['route'] is not None else None
+        self._route_limits = state.get('route_limits', (DEFAULT_TIME_BUDGET, DEFAULT_MAX_STOPS))
+        self._tree = None
+
+    def _get_ordinal(self, stop_id):
+        """Get the ordinal of a stop, adding the stop to the session if it is new"""
+        ordinal = self._ordinals.get(stop_id)
+        if ordinal is None:
+            ordinal = len(self._stop_ids)
+            self._stop_ids.append(stop_id)
+            self._ordinals[stop_id] = ordinal
+        return ordinal
+
+    def _encode(self, stop_ids):
+        """Get the bitset of a collection of stop ids"""
+        bits = 0
+        for stop_id in stop_ids:
+            bits |= 1 << self._get_ordinal(stop_id)
+        return bits
+
+    def _decode(self, bits):
+        return StopIdBitset(self._stop_ids, self._ordinals, bits)
+
+    @property
+    def candidates(self):
+        return self._decode(self._candidates)
+
+    @property
+    def collected(self):
+        return self._decode(self._collected)
+
+    @property
+    def ignored(self):
+        return self._decode(self._ignored)
+
+    @property
+    def skipped(self):
+        return self._decode(self._skipped)
+
+    @property
+    def remaining(self):
+        return self._decode(self._remaining)
+
+    def update(self, quests_found, version, snapshot, selection=None, start_of_day=None):
+        """Merge in quests of a newer snapshot, of a changed selection or of a new day"""
+        candidates = self._encode(quests_found)
+
+        removed = self._candidates & ~candidates
+        added = candidates & ~self._candidates & ~self._collected & ~self._ignored
+
+        self._remaining &= ~removed
+        self._skipped &= ~removed
+        if self._tree is not None:
+            for ordinal in _iter_ordinals(removed):
+                self._tree.remove(self._stop_ids[ordinal])
+
+        self._candidates = candidates
+        self.version = version
+        self.selection = selection
+        self.start_of_day = start_of_day
+
+        if added:
+            self._add_remaining(added, snapshot)
+
+    def collect(self, stop_id):
+        """Mark a quest as collected"""
+        ordinal = self._get_ordinal(stop_id)
+        self._collected |= 1 << ordinal
+        self._discard(ordinal)
+
+    def skip(self, stop_id):
+        """Defer a quest until all remaining quests have been visited"""
+        ordinal = self._ordinals.get(stop_id)
+        if ordinal is not None and (self._remaining >> ordinal) & 1:
+            self._discard(ordinal)
+            self._skipped |= 1 << ordinal
+
+    def ignore(self, stop_id):
+        """Never show a quest again"""
+        ordinal = self._get_ordinal(stop_id)
+        self._ignored |= 1 << ordinal
+        self._discard(ordinal)
+
+    def _discard(self, ordinal):
+        bit = 1 << ordinal
+        self._remaining &= ~bit
+        self._skipped &= ~bit
+        if self._tree is not None:
+            self._tree.remove(self._stop_ids[ordinal])
+
+    def enqueue_skipped(self, snapshot):
+        """Put all skipped quests back into the remaining quests. Returns the number of quests enqueued."""
+        count = len(self.skipped)
+        if count:
+            self._add_remaining(self._skipped, snapshot)
+            self._skipped = 0
+        return count
+
+    def _add_remaining(self, bits, snapshot):
+        """Add quests that need to be visited and insert them into the route where they add the least distance.
+
+        Quests are only inserted until the route has as many stops or the insertion took as long as the route was
+        planned with. Quests that don't fit are looked up in the tree once the route is done.
+        """
+        self._remaining |= bits
+        # the tree does not support insertion
+        self._tree = None
+
+        if self.route is not None:
+            (time_budget, max_stops) = self._route_limits
+            deadline = time.monotonic() + time_budget
+
+            points = {}
+            for ordinal in self.route:
+                if (self._remaining >> ordinal) & 1:
+                    self._add_point(points, ordinal, snapshot)
+            route = [ordinal for ordinal in self.route if ordinal in points]
+            for ordinal in _iter_ordinals(bits):
+                if len(route) >= max_stops or time.monotonic() > deadline:
+                    break
+                if ordinal not in points and self._add_point(points, ordinal, snapshot):
+                    route.insert(get_insert_position(route, points[ordinal], points), ordinal)
+            self.route = deque(route)
+
+    def _add_point(self, points, ordinal, snapshot):
+        """Add the location of a stop as unit vector to points. Returns False if the quest of the stop is gone."""
+        quest = snapshot.quests.get(self._stop_ids[ordinal])
+        if quest is None:
+            self._discard(ordinal)
+            return False
+        points[ordinal] = to_unit_vector(quest.latitude, quest.longitude)
+        return True
+
+    def _get_remaining_quests(self, snapshot):
+        """Get the quests of all remaining stops by stop id. Drops stops whose quest is gone."""
+        quests = {}
+        for ordinal in _iter_ordinals(self._remaining):
+            stop_id = self._stop_ids[ordinal]
+            quest = snapshot.quests.get(stop_id)
+            if quest is None:
+                self._discard(ordinal)
+            else:
+                quests[stop_id] = quest
+        return quests
+
+    def plan_route(self, snapshot, start, time_budget, max_stops):
+        """Plan the order in which to visit the remaining quests. Large areas may only get a route for some of them."""
+        route = plan_route(start=start,
+                           quests=self._get_remaining_quests(snapshot),
+                           time_budget=time_budget,
+                           max_stops=max_stops)
+        self.route = deque(self._ordinals[stop_id] for stop_id in route)
+        self._route_limits = (time_budget, max_stops)
+
+    def get_remaining_tree(self, snapshot):
+        """Get a kd-tree of the remaining quests. The snapshot must match the version of the session."""
+        if self._tree is None:
+            self._tree = QuestTree(self._get_remaining_quests(snapshot))
+        return self._tree
+
+    def get_next_quest(self, snapshot, location):
+        """Get (distance in meters, stop id) of the next stop of the route or of the closest quest without route"""
+        if self.route is not None:
+            # collected, skipped, ignored and removed quests are dropped from the route once they are up next
+            while self.route:
+                ordinal = self.route[0]
+                if (self._remaining >> ordinal) & 1:
+                    stop_id = self._stop_ids[ordinal]
+                    quest = snapshot.quests.get(stop_id)
+                    if quest is not None:
+                        return great_circle(location, (quest.latitude, quest.longitude)).meters, stop_id
+                    self._discard(ordinal)
+                self.route.popleft()
+            # quests the route wasn't planned for are looked up in the tree from now on
+            self.route = None
+
+        closest = self.get_remaining_tree(snapshot).get_closest(location)
+        return closest[0] if closest else (None, None)
@@ -0,0 +1,139 @@
+import heapq
+import math
+
+from quest.grid import EARTH_RADIUS
+
+
+def to_unit_vector(latitude, longitude):
+    """Convert a location to a point on the unit sphere"""
+    latitude = math.radians(latitude)
+    longitude = math.radians(longitude)
+    cos_latitude = math.cos(latitude)
+    return cos_latitude * math.cos(longitude), cos_latitude * math.sin(longitude), math.sin(latitude)
+
+
+def chord_to_meters(squared_chord):
+    """Convert the squared straight line distance of two unit vectors to a great circle distance"""
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(squared_chord) / 2))
+
+
+def get_distance(point_a, point_b):
+    """Great circle distance in meters between two unit vectors"""
+    return chord_to_meters((point_a[0] - point_b[0]) ** 2 +
+                           (point_a[1] - point_b[1]) ** 2 +
+                           (point_a[2] - point_b[2]) ** 2)
+
+
+class QuestTree:
+    """KD-tree of quest locations on the unit sphere. Stops can be removed without rebuilding the tree.
+
+    The straight line distance between two points on the unit sphere grows monotonically with their great circle
+    distance, so the nearest point in 3D is the nearest point on the earth as well.
+    """
+
+    def __init__(self, quests):
+        points = [(to_unit_vector(quest.latitude, quest.longitude), stop_id) for stop_id, quest in quests.items()]
+
+        size = len(points)
+        self._stop_ids = [None] * size
+        self._points = [None] * size
+        self._axes = [0] * size
+        self._left = [-1] * size
+        self._right = [-1] * size
+        self._parents = [-1] * size
+        # number of stops in the subtree of a node that have not been removed
+        self._counts = [0] * size
+        # stop id => node
+        self._nodes = {}
+
+        self._next_node = 0
+        self._root = self._build(points, -1)
+
+    def _build(self, points, parent):
+        """Recursively build a balanced subtree and return its root node"""
+        if not points:
+            return -1
+
+        # split along the axis with the largest spread
+        spreads = [max(p[0][axis] for p in points) - min(p[0][axis] for p in points) for axis in range(3)]
+        axis = spreads.index(max(spreads))
+        points.sort(key=lambda p: p[0][axis])
+        median = len(points) // 2
+
+        node = self._next_node
+        self._next_node += 1
+
+        point, stop_id = points[median]
+        self._stop_ids[node] = stop_id
+        self._points[node] = point
+        self._axes[node] = axis
+        self._parents[node] = parent
+        self._counts[node] = len(points)
+        self._nodes[stop_id] = node
+
+        self._left[node] = self._build(points[:median], node)
+        self._right[node] = self._build(points[median + 1:], node)
+
+        return node
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __contains__(self, stop_id):
+        return stop_id in self._nodes
+
+    def stop_ids(self):
+        """Get ids of all stops that have not been removed"""
+        return self._nodes.keys()
+
+    def remove(self, stop_id):
+        """Remove a stop from the tree. Returns whether the stop was part of the tree."""
+        node = self._nodes.pop(stop_id, None)
+        if node is None:
+            return False
+        # node stays in place for navigation, only its subtree counts change
+        self._stop_ids[node] = None
+        while node != -1:
+            self._counts[node] -= 1
+            node = self._parents[node]
+        return True
+
+    def get_closest(self, location, k=1):
+        """Get up to k stops closest to a location as a list of (distance in meters, stop id), closest first"""
+        if k < 1 or self._root == -1:
+            return []
+
+        target = to_unit_vector(location[0], location[1])
+
+        # max heap of the best k candidates as (-squared distance, stop id)
+        best = []
+
+        def search(node):
+            if node == -1 or self._counts[node] == 0:
+                return
+
+            point = self._points[node]
+            stop_id = self._stop_ids[node]
+            if stop_id is not None:
+                squared_distance = (point[0] - target[0]) ** 2 + \
+                                   (point[1] - target[1]) ** 2 + \
+                                   (point[2] - target[2]) ** 2
+                if len(best) < k:
+                    heapq.heappush(best, (-squared_distance, stop_id))
+                elif squared_distance < -best[0][0]:
+                    heapq.heapreplace(best, (-squared_distance, stop_id))
+
+            axis = self._axes[node]
+            difference = target[axis] - point[axis]
+            (near, far) = (self._left[node], self._right[node]) if difference < 0 else \
+                (self._right[node], self._left[node])
+
+            search(near)
+            # only visit the other side if it can contain something closer
+            if len(best) < k or difference ** 2 < -best[0][0]:
+                search(far)
+
+        search(self._root)
+
+        best.sort(reverse=True)
+        return [(chord_to_meters(-squared_distance), stop_id) for squared_distance, stop_id in best]
@@ -0,0 +1,62 @@
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class PokestopCache:
+    """Local copy of name and location of all pokestops so quests can be loaded without joining the pokestop table.
+
+    Stops that are not cached yet are loaded by id when quests of them are loaded. All stops are reloaded every
+    full_refresh_interval seconds to pick up renamed and moved stops and to get rid of removed stops. MAD's
+    last_updated column can't be used to find changed stops in between as it moves whenever a stop is scanned.
+    """
+
+    def __init__(self, full_refresh_interval):
+        self.full_refresh_interval = full_refresh_interval
+        # stop id => (name, latitude, longitude)
+        self._stops = {}
+        self._last_full_refresh = None
+
+    def __len__(self):
+        return len(self._stops)
+
+    def get(self, stop_id):
+        """Get (name, latitude, longitude) of a stop or None if the stop is unknown"""
+        return self._stops.get(stop_id)
+
+    def refresh(self, db):
+        """Load all stops if a full refresh is due"""
+        now = time.monotonic()
+        if self._last_full_refresh is not None and now - self._last_full_refresh < self.full_refresh_interval:
+            return
+
+        # keep the current stops until all stops have been loaded
+        stops = {}
+        count = self._load(db, "", (), stops)
+        changed = sum(1 for stop_id, stop in stops.items() if self._stops.get(stop_id) != stop)
+        removed = sum(1 for stop_id in self._stops if stop_id not in stops)
+        self._stops = stops
+        self._last_full_refresh = now
+        logger.info(f"Loaded {count} pokestops ({changed} new or changed, {removed} removed)")
+
+    def load_missing(self, db, stop_ids):
+        """Load stops that were added after the last refresh. Returns the number of stops found."""
+        stop_ids = list(stop_ids)
+        if not stop_ids:
+            return 0
+        placeholders = ", ".join(["%s"] * len(stop_ids))
+        return self._load(db, f"WHERE pokestop_id IN ({placeholders})", stop_ids, self._stops)
+
+    @staticmethod
+    def _load(db, condition, params, stops):
+        cursor = db.cursor()
+        cursor.execute(f"SELECT pokestop_id, name, latitude, longitude FROM pokestop {condition}", params)
+
+        count = 0
+        for (stop_id, name, latitude, longitude) in cursor:
+            stops[stop_id] = (name, latitude, longitude)
+            count += 1
+
+        cursor.close()
+        return count
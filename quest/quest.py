@@ -1,13 +1,34 @@
+import sys
+
+
 class Quest:
+    """A quest at a stop. Slots and interned strings keep the many quests in memory small."""
+
+    __slots__ = ('stop_id', 'stop_name', 'latitude', 'longitude', 'timestamp', 'pokemon_id', 'item_id',
+                 'item_amount', 'task_id')
 
     def __init__(self, stop_id, stop_name, latitude, longitude, timestamp, pokemon_id, item_id, item_amount, task_id):
 
-        self.stop_id = stop_id
-        self.stop_name = stop_name
+        # each row from the database comes with its own copies of these strings
+        self.stop_id = _intern(stop_id)
+        self.stop_name = _intern(stop_name)
         self.latitude = latitude
         self.longitude = longitude
         self.timestamp = timestamp
-        self.pokemon_id = pokemon_id
-        self.item_id = item_id
-        self.item_amount = item_amount
-        self.task_id = task_id
+        self.pokemon_id = int(pokemon_id or 0)
+        self.item_id = int(item_id or 0)
+        self.item_amount = int(item_amount or 0)
+        self.task_id = _intern(task_id)
+
+    def __eq__(self, other):
+        if not isinstance(other, Quest):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in Quest.__slots__)
+
+    # quests are compared by value, but don't need to be hashable
+    __hash__ = None
+
+
+def _intern(value):
+    """Get the interned version of a string so equal strings are only kept once"""
+    return sys.intern(value) if type(value) is str else value
@@ -0,0 +1,142 @@
+import heapq
+import time
+
+from quest.nearest import get_distance, to_unit_vector
+
+# seconds the planner may spend on a route
+DEFAULT_TIME_BUDGET = 0.5
+# maximum number of stops of a route
+DEFAULT_MAX_STOPS = 500
+
+
+def plan_route(start, quests, time_budget=DEFAULT_TIME_BUDGET, max_stops=DEFAULT_MAX_STOPS):
+    """Plan the order in which to visit quests when starting at a location. Returns a list of stop ids.
+
+    A nearest neighbour route is improved by 2-opt and or-opt moves until no move shortens the route any further or
+    the time budget in seconds is used up. Areas with more than max_stops quests only get a route for the max_stops
+    quests closest to the start as the distance matrix would be too large. The route is empty if even the distance
+    matrix can't be computed within the time budget. Quests without route need to be looked up one by one.
+    """
+    deadline = time.monotonic() + time_budget
+
+    start_point = to_unit_vector(*start)
+    quest_points = {stop_id: to_unit_vector(quest.latitude, quest.longitude) for stop_id, quest in quests.items()}
+
+    stop_ids = list(quests)
+    if len(stop_ids) > max_stops:
+        stop_ids = heapq.nsmallest(max_stops, stop_ids, key=lambda stop_id: get_distance(start_point,
+                                                                                          quest_points[stop_id]))
+
+    # index 0 is the start location, index i is stop_ids[i - 1]
+    points = [start_point] + [quest_points[stop_id] for stop_id in stop_ids]
+    size = len(points)
+
+    matrix = [[0.0] * size for _ in range(size)]
+    for i in range(size):
+        for j in range(i + 1, size):
+            matrix[i][j] = matrix[j][i] = get_distance(points[i], points[j])
+        if time.monotonic() > deadline:
+            return []
+
+    order = _get_nearest_neighbour_order(matrix)
+
+    while time.monotonic() < deadline:
+        improved = _improve_two_opt(order, matrix, deadline)
+        improved = _improve_or_opt(order, matrix, deadline) or improved
+        if not improved:
+            break
+
+    return [stop_ids[i - 1] for i in order[1:]]
+
+
+def _get_nearest_neighbour_order(matrix):
+    """Get an order of all locations that starts at location 0 and always continues with the closest location"""
+    unvisited = set(range(1, len(matrix)))
+    order = [0]
+    while unvisited:
+        distances = matrix[order[-1]]
+        closest = min(unvisited, key=distances.__getitem__)
+        unvisited.remove(closest)
+        order.append(closest)
+    return order
+
+
+def _improve_two_opt(order, matrix, deadline):
+    """Reverse parts of the route as long as that makes it shorter. The route doesn't return to its start."""
+    size = len(order)
+    improved = False
+    for i in range(1, size - 1):
+        for j in range(i + 1, size):
+            a, b, c = order[i - 1], order[i], order[j]
+            delta = matrix[a][c] - matrix[a][b]
+            if j + 1 < size:
+                d = order[j + 1]
+                delta += matrix[b][d] - matrix[c][d]
+            if delta < -1e-6:
+                order[i:j + 1] = reversed(order[i:j + 1])
+                improved = True
+        if time.monotonic() > deadline:
+            break
+    return improved
+
+
+def _improve_or_opt(order, matrix, deadline):
+    """Move segments of up to three stops to a better place in the route"""
+    size = len(order)
+    improved = False
+    for length in (1, 2, 3):
+        i = 1
+        while i + length <= size:
+            first, last = order[i], order[i + length - 1]
+            previous = order[i - 1]
+            following = order[i + length] if i + length < size else None
+
+            # distance saved by taking the segment out of the route
+            saved = matrix[previous][first]
+            if following is not None:
+                saved += matrix[last][following] - matrix[previous][following]
+
+            best_position, best_cost = None, saved - 1e-6
+            for position in range(size):
+                # skip positions next to or inside the segment
+                if i - 1 <= position <= i + length - 1:
+                    continue
+                x = order[position]
+                cost = matrix[x][first]
+                if position + 1 < size:
+                    y = order[position + 1]
+                    cost += matrix[last][y] - matrix[x][y]
+                if cost < best_cost:
+                    best_position, best_cost = position, cost
+
+            if best_position is not None:
+                segment = order[i:i + length]
+                del order[i:i + length]
+                insert_at = best_position + 1 if best_position < i else best_position + 1 - length
+                order[insert_at:insert_at] = segment
+                improved = True
+            else:
+                i += 1
+
+            if time.monotonic() > deadline:
+                return improved
+    return improved
+
+
+def get_insert_position(route, point, points):
+    """Get the position in a route where inserting a location adds the least distance. Locations are unit vectors,
+    points maps the stops of the route to theirs."""
+    if not route:
+        return 0
+
+    # inserting in front of the route only adds the way to the first stop
+    best_position, best_cost = 0, get_distance(point, points[route[0]])
+    for position in range(1, len(route) + 1):
+        previous = points[route[position - 1]]
+        cost = get_distance(previous, point)
+        if position < len(route):
+            following = points[route[position]]
+            cost += get_distance(point, following) - get_distance(previous, following)
+        if cost < best_cost:
+            best_position, best_cost = position, cost
+    return best_position
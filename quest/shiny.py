@@ -0,0 +1,104 @@
+import json
+import logging
+import os
+
+import requests
+
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+# dex ids of all pokemon that can be shiny when found in the wild or as research reward
+_shiny_pokemon = frozenset()
+
+# validators of the last response for conditional requests
+_etag = None
+_last_modified = None
+
+
+def get_shiny_pokemon():
+    """Get the dex ids of all pokemon that can be shiny"""
+    return _shiny_pokemon
+
+
+def load_cached_shinies(cache_file):
+    """Load the shiny pokemon from the cache file. Returns False if there is no usable cache file."""
+    global _shiny_pokemon, _etag, _last_modified
+    try:
+        with open(file=cache_file, mode='r', encoding='utf-8') as f:
+            cache = json.load(f)
+        shiny_pokemon = frozenset(int(dex_id) for dex_id in cache['pokemon'])
+    except FileNotFoundError:
+        return False
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.warning(f"Ignoring invalid shiny cache file {cache_file}: {e}")
+        return False
+
+    _shiny_pokemon = shiny_pokemon
+    _etag = cache.get('etag')
+    _last_modified = cache.get('last_modified')
+    logger.info(f"Loaded {len(_shiny_pokemon)} shiny pokemon from {cache_file}")
+    return True
+
+
+def _save_cache(cache_file):
+    temp_file = f"{cache_file}.tmp"
+    with open(file=temp_file, mode='w', encoding='utf-8') as f:
+        json.dump({'etag': _etag, 'last_modified': _last_modified, 'pokemon': sorted(_shiny_pokemon)}, f)
+    os.replace(temp_file, cache_file)
+
+
+def refresh_shinies(url, cache_file, timeout):
+    """Download the list of shiny pokemon unless it didn't change since the last download"""
+    global _shiny_pokemon, _etag, _last_modified
+
+    headers = {}
+    # only ask for changes if the list we have is still there
+    if _shiny_pokemon:
+        if _etag:
+            headers['If-None-Match'] = _etag
+        if _last_modified:
+            headers['If-Modified-Since'] = _last_modified
+
+    with requests.get(url, headers=headers, timeout=timeout, stream=True) as response:
+        if response.status_code == 304:
+            logger.info("List of shiny pokemon is unchanged")
+            return
+        response.raise_for_status()
+        shiny_pokemon = _parse_shinies(response.iter_content(chunk_size=64 * 1024))
+
+    if not shiny_pokemon:
+        logger.warning(f"No shiny pokemon found on {url}. Keeping the previous list.")
+        return
+
+    _shiny_pokemon = frozenset(shiny_pokemon)
+    _etag = response.headers.get('ETag')
+    _last_modified = response.headers.get('Last-Modified')
+    _save_cache(cache_file)
+    logger.info(f"Loaded {len(_shiny_pokemon)} shiny pokemon")
+
+
+def _parse_shinies(chunks):
+    """Get dex ids from links in table rows of wild and research shinies while the page is still downloading"""
+    parser = etree.HTMLPullParser(events=('start', 'end'))
+    shiny_pokemon = set()
+    # number of open shiny table rows
+    open_rows = 0
+
+    for chunk in chunks:
+        parser.feed(chunk)
+        for (event, element) in parser.read_events():
+            if element.tag == 'tr':
+                css_class = element.get('class', '')
+                if 'Wild' in css_class or 'Research' in css_class:
+                    open_rows += 1 if event == 'start' else -1
+                if event == 'end':
+                    # rows are not needed after they have been read
+                    element.clear()
+            elif element.tag == 'a' and event == 'start' and open_rows:
+                digits = "".join(digit for digit in element.get('href', '') if digit.isdigit())
+                if digits:
+                    shiny_pokemon.add(int(digits))
+
+    parser.close()
+    return shiny_pokemon
@@ -0,0 +1,195 @@
+import uuid
+
+from threading import Lock
+from types import MappingProxyType
+
+from quest.columnar import ColumnarQuestStore
+from quest.expiry import is_expired
+from quest.grid import QuestGrid
+
+# versions start over when the bot restarts or resume from the snapshot file. this tells runs apart
+BOOT_ID = uuid.uuid4().hex
+
+
+class QuestSnapshot:
+    """Immutable, versioned view of all quests and their indexes. Never modify a published snapshot."""
+
+    def __init__(self, version, quests, grid, pokemon_index, item_index, task_index, use_columnar_store=False,
+                 pokemon_list=None, items_list=None):
+        self.version = version
+        # version that is unique across runs of the bot, for data that is persisted
+        self.unique_version = (BOOT_ID, version)
+        # stop id => quest
+        self.quests = MappingProxyType(quests)
+        # spatial index
+        self.grid = grid
+        # inverted indexes (reward / task => set of stop ids)
+        self.pokemon_index = pokemon_index
+        self.item_index = item_index
+        self.task_index = task_index
+        # sorted pokemon and items that are currently available as reward
+        if pokemon_list is None:
+            pokemon_list = tuple(sorted(pokemon_id for pokemon_id in pokemon_index if pokemon_id != 0))
+        if items_list is None:
+            items_list = tuple(sorted(item_id for item_id in item_index if item_id != 0))
+        self.pokemon_list = pokemon_list
+        self.items_list = items_list
+        # optional columnar copy of all quests, built when it is read for the first time
+        self._use_columnar_store = use_columnar_store
+        self._columnar_store = None
+        self._columnar_store_lock = Lock()
+        # start of day => number of quests that have not expired by then
+        self._counts = {}
+
+    @property
+    def columnar_store(self):
+        """Get the columnar copy of all quests or None if it is disabled. Snapshots that are replaced before anyone
+        queries them never build it."""
+        if self._use_columnar_store and self._columnar_store is None:
+            with self._columnar_store_lock:
+                if self._columnar_store is None:
+                    self._columnar_store = ColumnarQuestStore(self.quests)
+        return self._columnar_store
+
+    def count_quests(self, start_of_day):
+        """Count the quests that have not expired by the start of a day. Expired quests are removed in batches, so
+        they may still be part of the snapshot."""
+        count = self._counts.get(start_of_day)
+        if count is None:
+            count = sum(1 for quest in self.quests.values() if not is_expired(quest, start_of_day))
+            self._counts[start_of_day] = count
+        return count
+
+    @staticmethod
+    def empty():
+        """Get a snapshot without any quests"""
+        return QuestSnapshot(version=0, quests={}, grid=QuestGrid(), pokemon_index={}, item_index={}, task_index={})
+
+
+class QuestSnapshotBuilder:
+    """Build the next snapshot off to the side. Data shared with the base snapshot is copied before modification."""
+
+    def __init__(self, base: QuestSnapshot, use_columnar_store=False):
+        self._base = base
+        # version of the snapshot that will be built
+        self.version = base.version + 1
+        self._use_columnar_store = use_columnar_store
+        self.quests = dict(base.quests)
+        self._grid = base.grid.copy()
+        self._pokemon_index = dict(base.pokemon_index)
+        self._item_index = dict(base.item_index)
+        self._task_index = dict(base.task_index)
+        # (index id, key) of all sets that have been copied from the base snapshot already
+        self._owned_keys = set()
+        # stop id => (quest in the base snapshot or None, new quest or None) of all stops that changed
+        self._changes = {}
+        # whether a reward or task has been added to or removed from the indexes
+        self._index_keys_changed = False
+
+    def _add_to_index(self, index, key, stop_id):
+        """Add a stop to the set of an index key"""
+        if key not in index:
+            index[key] = {stop_id}
+            self._owned_keys.add((id(index), key))
+            self._index_keys_changed = True
+        else:
+            self._get_own_set(index, key).add(stop_id)
+
+    def _remove_from_index(self, index, key, stop_id):
+        """Remove a stop from the set of an index key and drop the key once its set is empty"""
+        if key in index:
+            stop_ids = self._get_own_set(index, key)
+            stop_ids.discard(stop_id)
+            if not stop_ids:
+                del index[key]
+                self._owned_keys.discard((id(index), key))
+                self._index_keys_changed = True
+
+    def _get_own_set(self, index, key):
+        """Get the set of an index key, copying it first if it is still shared with the base snapshot"""
+        if (id(index), key) not in self._owned_keys:
+            index[key] = set(index[key])
+            self._owned_keys.add((id(index), key))
+        return index[key]
+
+    def _record_change(self, stop_id, quest):
+        """Remember how a stop changed compared to the base snapshot"""
+        base_quest = self._base.quests.get(stop_id)
+        if base_quest == quest:
+            self._changes.pop(stop_id, None)
+        else:
+            self._changes[stop_id] = (base_quest, quest)
+
+    def add_quest(self, quest):
+        """Add a quest or replace the existing quest of the same stop. Returns False if the quest is unchanged."""
+        stop_id = quest.stop_id
+
+        if stop_id in self.quests:
+            # leave unchanged quests untouched
+            if self.quests[stop_id] == quest:
+                return False
+            # remove replaced quest from indexes
+            self._remove_from_indexes(self.quests[stop_id])
+
+        self._record_change(stop_id, quest)
+        self.quests[stop_id] = quest
+        self._grid.add(stop_id, quest.latitude, quest.longitude)
+        self._add_to_index(self._pokemon_index, quest.pokemon_id, stop_id)
+        self._add_to_index(self._item_index, quest.item_id, stop_id)
+        self._add_to_index(self._task_index, quest.task_id, stop_id)
+        return True
+
+    def remove_quest(self, stop_id):
+        """Remove the quest of a stop"""
+        quest = self.quests.pop(stop_id, None)
+        if quest is not None:
+            self._record_change(stop_id, None)
+            self._grid.remove(stop_id)
+            self._remove_from_indexes(quest)
+
+    def _remove_from_indexes(self, quest):
+        self._remove_from_index(self._pokemon_index, quest.pokemon_id, quest.stop_id)
+        self._remove_from_index(self._item_index, quest.item_id, quest.stop_id)
+        self._remove_from_index(self._task_index, quest.task_id, quest.stop_id)
+
+    def remove_all_quests(self):
+        """Remove all quests"""
+        for stop_id in self.quests:
+            self._record_change(stop_id, None)
+        self.quests = {}
+        self._grid.clear()
+        self._pokemon_index = {}
+        self._item_index = {}
+        self._task_index = {}
+        self._owned_keys = set()
+        self._index_keys_changed = True
+
+    def get_changes(self):
+        """Get (quest in the base snapshot or None, new quest or None) of all stops that changed by stop id"""
+        return self._changes
+
+    def get_changeset(self):
+        """Get the stop ids of all added, changed and removed quests"""
+        added = {stop_id for stop_id, (old, new) in self._changes.items() if old is None}
+        removed = {stop_id for stop_id, (old, new) in self._changes.items() if new is None}
+        changed = set(self._changes) - added - removed
+        return added, changed, removed
+
+    def build(self):
+        """Create the next snapshot or return the base snapshot if nothing changed. Don't use the builder afterwards."""
+        if not self._changes:
+            return self._base
+
+        # the sorted rewards only need to be recomputed if rewards were added or removed
+        pokemon_list = None if self._index_keys_changed else self._base.pokemon_list
+        items_list = None if self._index_keys_changed else self._base.items_list
+
+        return QuestSnapshot(version=self.version,
+                             quests=self.quests,
+                             grid=self._grid,
+                             pokemon_index=self._pokemon_index,
+                             item_index=self._item_index,
+                             task_index=self._task_index,
+                             use_columnar_store=self._use_columnar_store,
+                             pokemon_list=pokemon_list,
+                             items_list=items_list)
@@ -0,0 +1,100 @@
+import logging
+import mmap
+import os
+import struct
+
+from quest.quest import Quest
+
+logger = logging.getLogger(__name__)
+
+# file layout:
+#   header: magic, format version, snapshot version, watermark (latest quest scan), quest count, size of string table
+#   one fixed size record per quest
+#   string table with stop ids, stop names and task ids. every distinct string is stored once.
+_MAGIC = b'QPSF'
+_FORMAT_VERSION = 1
+_HEADER = struct.Struct('<4sHQdII')
+# latitude, longitude, timestamp, pokemon id, item id, item amount, (offset, length) of stop id, stop name, task id
+_RECORD = struct.Struct('<dddiiiIHIHIH')
+# length of a stop name that is None
+_NONE_LENGTH = 0xFFFF
+
+
+def save_snapshot_file(path, snapshot, watermark):
+    """Write all quests of a snapshot to a binary file. The file is replaced atomically."""
+    strings = bytearray()
+    string_offsets = {}
+
+    def add_string(value):
+        if value is None:
+            return 0, _NONE_LENGTH
+        if value not in string_offsets:
+            encoded = value.encode('utf-8')[:_NONE_LENGTH - 1]
+            string_offsets[value] = (len(strings), len(encoded))
+            strings.extend(encoded)
+        return string_offsets[value]
+
+    records = bytearray(_RECORD.size * len(snapshot.quests))
+    for i, quest in enumerate(snapshot.quests.values()):
+        _RECORD.pack_into(records, i * _RECORD.size,
+                          quest.latitude, quest.longitude, quest.timestamp,
+                          quest.pokemon_id or 0, quest.item_id or 0, quest.item_amount or 0,
+                          *add_string(quest.stop_id), *add_string(quest.stop_name), *add_string(quest.task_id))
+
+    temp_path = f"{path}.tmp"
+    with open(file=temp_path, mode='wb') as f:
+        f.write(_HEADER.pack(_MAGIC, _FORMAT_VERSION, snapshot.version, watermark, len(snapshot.quests), len(strings)))
+        f.write(records)
+        f.write(strings)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def load_snapshot_file(path):
+    """Read a snapshot file. Returns (snapshot version, watermark, list of quests) or None if there is no valid file."""
+    try:
+        with open(file=path, mode='rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return _read(data)
+    except (OSError, ValueError, struct.error, UnicodeDecodeError) as e:
+        if not isinstance(e, FileNotFoundError):
+            logger.warning(f"Ignoring invalid snapshot file {path}: {e}")
+        return None
+
+
+def _read(data):
+    (magic, format_version, version, watermark, count, strings_size) = _HEADER.unpack_from(data, 0)
+    if magic != _MAGIC or format_version != _FORMAT_VERSION:
+        raise ValueError("unknown file format")
+
+    records_offset = _HEADER.size
+    strings_offset = records_offset + count * _RECORD.size
+    if len(data) != strings_offset + strings_size:
+        raise ValueError("file is truncated")
+
+    strings = {}
+
+    def get_string(offset, length):
+        if length == _NONE_LENGTH:
+            return None
+        if offset not in strings:
+            start = strings_offset + offset
+            strings[offset] = data[start:start + length].decode('utf-8')
+        return strings[offset]
+
+    quests = []
+    for i in range(count):
+        (latitude, longitude, timestamp, pokemon_id, item_id, item_amount,
+         stop_id_offset, stop_id_length, stop_name_offset, stop_name_length, task_id_offset, task_id_length) = \
+            _RECORD.unpack_from(data, records_offset + i * _RECORD.size)
+        quests.append(Quest(stop_id=get_string(stop_id_offset, stop_id_length),
+                            stop_name=get_string(stop_name_offset, stop_name_length),
+                            latitude=latitude,
+                            longitude=longitude,
+                            timestamp=timestamp,
+                            pokemon_id=pokemon_id,
+                            item_id=item_id,
+                            item_amount=item_amount,
+                            task_id=get_string(task_id_offset, task_id_length)))
+
+    return version, watermark, quests
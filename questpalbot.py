@@ -4,29 +4,41 @@ import sys
 import traceback
 from functools import partial
 
-import mysql.connector
-import requests
-
-from lxml import html
-from datetime import datetime, time
+from datetime import time
 
 from telegram import Bot, Update, InlineKeyboardButton
+from telegram.error import RetryAfter, TimedOut
 from telegram.utils.helpers import mention_markdown
 from telegram.utils.request import Request
 from telegram.ext import CommandHandler, CallbackQueryHandler, ConversationHandler, MessageHandler, \
-    Updater, CallbackContext, Filters, messagequeue, PicklePersistence
+    Updater, CallbackContext, Filters
 
+from bot.database import get_connection, iter_rows
+from bot.jobs import BackgroundJobRunner
 from bot.messagequeuebot import MQBot
+from bot.persistence import SqlitePersistence, add_chat_data_handlers
+from bot.scheduler import RequestScheduler
+from bot.webhook import start_webhook_server, get_webhook_stats
 
 from chat import chat, conversation, utils, profile
 from chat.admin import restart, git_pull
-from chat.config import bot_token, bot_use_message_queue, bot_provider, log_file, \
-    mysql_host, mysql_port, mysql_user, mysql_password, mysql_db
+from chat.config import bot_token, bot_use_message_queue, bot_provider, log_file, bot_background_workers, \
+    persistence_database, persistence_flush_interval, chat_data_idle_timeout, chat_data_max_resident_chats, \
+    bot_requests_per_second, bot_chat_requests_per_second, bot_chat_request_burst, bot_group_requests_per_minute, \
+    bot_request_workers, bot_request_max_retries, bot_request_retry_delay, bot_request_max_queue_size, \
+    bot_request_max_retry_wait, \
+    mysql_fetch_size, mysql_pokestop_refresh_interval, webhook_enabled, webhook_host, webhook_port, \
+    quests_snapshot_file, quests_snapshot_interval, quests_sweep_interval, quests_sweep_batch_size, shinies_url, \
+    shinies_cache_file
 from chat.utils import extract_ids, get_text, get_emoji, message_user, MessageType, MessageCategory, notify_devs, \
-    set_bot
+    set_bot, start_message_log, stop_message_log
 
-from quest.data import quests, quest_pokemon_list, quest_items_list, shiny_pokemon_list, get_task_by_id
+from quest.data import get_task_by_id, get_snapshot, edit_quests, get_range_cache_stats
+from quest.expiry import get_start_of_day, is_expired
+from quest.pokestop import PokestopCache
 from quest.quest import Quest
+from quest.shiny import load_cached_shinies, refresh_shinies
+from quest.snapshotfile import save_snapshot_file, load_snapshot_file
 
 # enable logging
 logging.basicConfig(format='%(asctime)s - %(name)s:%(lineno)d - %(levelname)s - %(message)s',
@@ -37,77 +49,125 @@ logger = logging.getLogger(__name__)
 
 latest_quest_scan = 0
 
+# seconds to wait for the list of shiny pokemon
+SHINIES_TIMEOUT = 60
 
-def load_quests(context: CallbackContext):
-    db = mysql.connector.connect(
-        host=mysql_host,
-        port=mysql_port,
-        user=mysql_user,
-        passwd=mysql_password,
-        database=mysql_db
-    )
+# seconds between checks for idle chats whose chat data can be removed from memory
+CHAT_DATA_EVICTION_INTERVAL = 60
 
-    global latest_quest_scan
+# name and location of all stops
+pokestops = PokestopCache(full_refresh_interval=mysql_pokestop_refresh_interval)
 
-    midnight = datetime.combine(datetime.today(), time.min).timestamp()
 
-    # make sure only quests from today get loaded
-    if midnight > latest_quest_scan:
-        latest_quest_scan = midnight
-
-    cursor = db.cursor()
-    cursor.execute("SELECT "
-                   "ps.pokestop_id,"
-                   "ps.name, "
-                   "ps.latitude, "
-                   "ps.longitude, "
-                   "q.quest_timestamp, "
-                   "q.quest_pokemon_id, "
-                   "q.quest_item_id, "
-                   "q.quest_item_amount, "
-                   "q.quest_template "
-                   "FROM trs_quest as q "
-                   "LEFT JOIN pokestop as ps "
-                   "ON q.GUID = ps.pokestop_id "
-                   "WHERE q.quest_timestamp >= %s "
-                   "AND q.quest_stardust = 0 "
-                   "ORDER BY q.quest_timestamp DESC",
-                   (latest_quest_scan, ))
-
-    result = cursor.fetchall()
-
-    db.close()
+def _join_pokestops(db, cursor):
+    """Join streamed quest rows with the cached pokestops. Yields (row, stop) pairs and closes the cursor."""
+    # quests of stops that are not in the cache yet
+    pending_rows = []
 
-    unknown_tasks = {}
+    for row in iter_rows(cursor, mysql_fetch_size):
+        stop = pokestops.get(row[0])
+        if stop is None:
+            pending_rows.append(row)
+            continue
+        yield row, stop
+
+    cursor.close()
 
-    for (stop_id, stop_name, latitude, longitude, timestamp, pokemon_id, item_id, item_amount, task_id) in result:
+    # the connection is free again, so look up the missing stops at once
+    if pending_rows:
+        pokestops.load_missing(db, {row[0] for row in pending_rows})
 
-        # skip quest if older than the existing quest entry
-        if stop_id in quests and quests[stop_id].timestamp > timestamp:
+    unknown_stop_ids = set()
+    for row in pending_rows:
+        stop = pokestops.get(row[0])
+        if stop is None:
+            unknown_stop_ids.add(row[0])
             continue
+        yield row, stop
+
+    if unknown_stop_ids:
+        logger.warning(f"Skipped quests of {len(unknown_stop_ids)} unknown pokestops")
+
+
+def _create_quest(row, stop):
+    """Create a quest from a quest row joined with its stop"""
+    (stop_id, timestamp, pokemon_id, item_id, item_amount, task_id) = row
+    (stop_name, latitude, longitude) = stop
+
+    return Quest(stop_id=stop_id,
+                 stop_name=stop_name,
+                 latitude=latitude,
+                 longitude=longitude,
+                 timestamp=timestamp,
+                 pokemon_id=pokemon_id,
+                 item_id=item_id,
+                 item_amount=item_amount,
+                 task_id=task_id)
+
+
+def load_quests(context: CallbackContext):
+    global latest_quest_scan
+
+    start_of_day = get_start_of_day()
+
+    # make sure only quests from today get loaded
+    if start_of_day > latest_quest_scan:
+        latest_quest_scan = start_of_day
+
+    unknown_tasks = {}
 
-        # remember quest rewards
-        if pokemon_id != 0 and pokemon_id not in quest_pokemon_list:
-            quest_pokemon_list.append(pokemon_id)
-        if item_id != 0 and item_id not in quest_items_list:
-            quest_items_list.append(item_id)
-
-        # create new quest object
-        quests[stop_id] = Quest(stop_id=stop_id,
-                                stop_name=stop_name,
-                                latitude=latitude,
-                                longitude=longitude,
-                                timestamp=timestamp,
-                                pokemon_id=pokemon_id,
-                                item_id=item_id,
-                                item_amount=item_amount,
-                                task_id=task_id)
-
-        if get_task_by_id('en', task_id) == task_id:
-            unknown_tasks[task_id] = quests[stop_id]
-
-        if timestamp > latest_quest_scan:
-            latest_quest_scan = timestamp + 1
+    row_count = 0
+    next_quest_scan = latest_quest_scan
+
+    # newest quest of each stop. read before the snapshot is locked, so webhooks and the sweeper don't wait for the db
+    quests = {}
+
+    with get_connection() as db:
+        # reload all stops if a full refresh is due before joining them with the quests
+        pokestops.refresh(db)
+
+        # unbuffered cursor, rows are streamed from the server and turned into quests right away
+        cursor = db.cursor(buffered=False)
+        cursor.execute("SELECT "
+                       "GUID, "
+                       "quest_timestamp, "
+                       "quest_pokemon_id, "
+                       "quest_item_id, "
+                       "quest_item_amount, "
+                       "quest_template "
+                       "FROM trs_quest "
+                       "WHERE quest_timestamp >= %s "
+                       "AND quest_stardust = 0",
+                       (latest_quest_scan, ))
+
+        for (row, stop) in _join_pokestops(db, cursor):
+            row_count += 1
+
+            (stop_id, timestamp) = row[:2]
+            if timestamp > next_quest_scan:
+                next_quest_scan = timestamp + 1
+
+            # skip quest if older than another quest of the same stop
+            if stop_id in quests and quests[stop_id].timestamp > timestamp:
+                continue
+            quests[stop_id] = _create_quest(row, stop)
+
+    # build the next snapshot off to the side
+    with edit_quests() as builder:
+        for quest in quests.values():
+            # skip quest if older than the existing quest entry
+            if quest.stop_id in builder.quests and builder.quests[quest.stop_id].timestamp > quest.timestamp:
+                continue
+            if not builder.add_quest(quest):
+                continue
+
+            if get_task_by_id('en', quest.task_id) == quest.task_id:
+                unknown_tasks[quest.task_id] = quest
+
+        (added, changed, _) = builder.get_changeset()
+
+    # only move on once the quests have been published
+    latest_quest_scan = next_quest_scan
 
     if unknown_tasks:
         text = f"{get_emoji('bug')} *Bug Report*\n\n" \
@@ -121,43 +181,120 @@ def load_quests(context: CallbackContext):
         # inform devs
         notify_devs(text=text)
 
-    quest_pokemon_list.sort()
-    quest_items_list.sort()
+    snapshot = get_snapshot()
+    cache_stats = get_range_cache_stats()
+
+    logger.info(f"{row_count} new quests loaded from DB ({len(added)} added, {len(changed)} changed). "
+                f"Total quest count: {len(snapshot.quests)} (snapshot #{snapshot.version})")
+    logger.info(f"Quest range cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses "
+                f"({cache_stats['hit_rate']:.0%}), {cache_stats['size']} / {cache_stats['max_size']} entries")
+
+    if webhook_enabled:
+        webhook_stats = get_webhook_stats()
+        logger.info(f"Quest webhooks: {webhook_stats['received']} received, {webhook_stats['accepted']} accepted, "
+                    f"{webhook_stats['rejected']} rejected in {webhook_stats['batches']} batches, "
+                    f"ingest latency {webhook_stats['latency_avg'] * 1000:.1f} ms on average, "
+                    f"{webhook_stats['latency_max'] * 1000:.1f} ms max")
+
+    if isinstance(context.bot, MQBot):
+        request_stats = context.bot.get_request_stats()
+        logger.info(f"Outgoing requests: {request_stats['sent']} sent, {request_stats['coalesced']} edits merged, "
+                    f"{request_stats['retry_after']} flood limits hit, {request_stats['network_errors']} network "
+                    f"errors, {request_stats['retries']} retries, {request_stats['failed']} failed, "
+                    f"{request_stats['shed']} deletions dropped, {request_stats['queued']} queued, "
+                    f"wait {request_stats['wait_avg'] * 1000:.0f} ms on average, "
+                    f"{request_stats['wait_max'] * 1000:.0f} ms max")
+
+
+def expire_quests(context: CallbackContext):
+    """Remove a batch of quests from previous days. New quests of the same stops may have replaced them already."""
+    start_of_day = get_start_of_day()
+
+    expired = [stop_id for stop_id, quest in get_snapshot().quests.items() if is_expired(quest, start_of_day)]
+    if not expired:
+        return
+
+    with edit_quests() as builder:
+        for stop_id in expired[:quests_sweep_batch_size]:
+            # a new quest may have arrived meanwhile
+            if stop_id in builder.quests and is_expired(builder.quests[stop_id], start_of_day):
+                builder.remove_quest(stop_id)
+
+    logger.info(f"Removed {min(len(expired), quests_sweep_batch_size)} expired quests, "
+                f"{max(len(expired) - quests_sweep_batch_size, 0)} left.")
+
 
-    logger.info(f"{len(result)} new quests loaded from DB. Total quest count: {len(quests)}")
+def save_quests(context: CallbackContext):
+    """Save all quests to the snapshot file"""
+    # read the watermark first, the snapshot is at least as recent
+    watermark = latest_quest_scan
+    snapshot = get_snapshot()
+    save_snapshot_file(quests_snapshot_file, snapshot, watermark)
+    logger.info(f"Saved {len(snapshot.quests)} quests to {quests_snapshot_file} (snapshot #{snapshot.version})")
 
 
-def clear_quests(context: CallbackContext):
-    """Clears all quests"""
+def warm_start():
+    """Load quests from the snapshot file so that only newer quests need to be loaded from the database"""
     global latest_quest_scan
-    # set last quest scan to midnight
-    latest_quest_scan = datetime.combine(datetime.today(), time.min).timestamp()
 
-    quests.clear()
+    loaded = load_snapshot_file(quests_snapshot_file)
+    if loaded is None:
+        return
+    (version, watermark, quests) = loaded
 
-    logger.info("All quests cleared.")
+    # quests from before midnight are outdated
+    start_of_day = get_start_of_day()
+    if watermark < start_of_day:
+        logger.info(f"Quests in {quests_snapshot_file} are outdated")
+        return
+
+    with edit_quests() as builder:
+        # keep versions increasing across restarts
+        builder.version = max(builder.version, version + 1)
+        for quest in quests:
+            if not is_expired(quest, start_of_day):
+                builder.add_quest(quest)
+
+    latest_quest_scan = watermark
+
+    logger.info(f"Loaded {len(get_snapshot().quests)} quests from {quests_snapshot_file} "
+                f"(snapshot #{get_snapshot().version})")
 
 
 def load_shinies(context: CallbackContext):
     """Load all shiny pokemon"""
-    address = 'https://pokemongo.gamepress.gg/pokemon-go-shinies-list'
-    raw = requests.get(address)
-    data = html.fromstring(raw.content)
-    wild_shiny_links = data.xpath("//tr[contains(@class, 'Wild') or contains(@class, 'Research')]//a")
+    refresh_shinies(url=shinies_url, cache_file=shinies_cache_file, timeout=SHINIES_TIMEOUT)
+
+
+def evict_chat_data(context: CallbackContext):
+    """Remove the chat data of idle chats from memory"""
+    persistence = context.dispatcher.persistence
+    if persistence.evict_chat_data():
+        stats = persistence.get_chat_data_stats()
+        logger.info(f"Chat data: {stats['resident']} / {stats['total']} chats in memory, "
+                    f"{stats['loads']} loaded, {stats['evictions']} evicted")
 
-    shiny_pokemon_list.clear()
 
-    for link_tag in wild_shiny_links:
-        link = link_tag.attrib['href']
-        dex_id = int("".join(digit for digit in link if digit.isdigit()))
-        if dex_id not in shiny_pokemon_list:
-            shiny_pokemon_list.append(dex_id)
+def shut_down(background_jobs, bot):
+    """Stop all background work and save what is still in memory"""
+    background_jobs.shutdown()
+    stop_message_log()
+    # send deferred deletions
+    if isinstance(bot, MQBot):
+        bot.stop_scheduler()
 
-    shiny_pokemon_list.sort()
+    # the next start continues with these quests
+    if quests_snapshot_file:
+        save_quests(None)
 
 
 def error(update: Update, context: CallbackContext):
     """Handle Errors caused by Updates."""
+    # flood limits and timeouts are retried by the request scheduler where possible. what is left is no bug
+    if isinstance(context.error, (RetryAfter, TimedOut)):
+        logger.warning(f"Update {update.update_id if update else None} failed: {context.error}")
+        return
+
     # get traceback
     trace = "".join(traceback.format_tb(sys.exc_info()[2]))
 
@@ -210,16 +347,25 @@ def main():
     logger.info("Starting Bot.")
 
     # request object for bot
-    request = Request(con_pool_size=8)
+    request = Request(con_pool_size=8 + bot_request_workers)
 
     # use message queue bot version
     if bot_use_message_queue:
-        logger.info("Using MessageQueue to avoid flood limits.")
-        # enable message queue with production limits
-        msg_queue = messagequeue.MessageQueue(all_burst_limit=29, all_time_limit_ms=1017,
-                                              group_burst_limit=20, group_time_limit_ms=60000)
+        logger.info("Using a request scheduler to avoid flood limits.")
+        # schedule all api calls within production limits
+        scheduler = RequestScheduler(rate=bot_requests_per_second,
+                                     burst=bot_requests_per_second,
+                                     chat_rate=bot_chat_requests_per_second,
+                                     chat_burst=bot_chat_request_burst,
+                                     group_rate=bot_group_requests_per_minute / 60,
+                                     group_burst=bot_chat_request_burst,
+                                     workers=bot_request_workers,
+                                     max_retries=bot_request_max_retries,
+                                     retry_delay=bot_request_retry_delay,
+                                     max_retry_wait=bot_request_max_retry_wait,
+                                     max_queue_size=bot_request_max_queue_size)
         # create a message queue bot
-        bot = MQBot(bot_token, request=request, msg_queue=msg_queue)
+        bot = MQBot(bot_token, request=request, scheduler=scheduler)
     # use regular bot
     else:
         logger.info("Using no MessageQueue. You may run into flood limits.")
@@ -227,26 +373,60 @@ def main():
         bot = Bot(bot_token, request=request)
 
     set_bot(bot=bot)
+    start_message_log()
     notify_devs(text=f"{get_emoji('info')} *Starting Bot*\n\nBot is starting.")
 
-    persistence = PicklePersistence(filename='persistent_data.pickle')
+    # only the data of chats that changed is written, existing data of PicklePersistence is imported once.
+    # chats are loaded on their first update and evicted from memory when they are idle
+    persistence = SqlitePersistence(database=persistence_database,
+                                    flush_interval=persistence_flush_interval,
+                                    pickle_file='persistent_data.pickle',
+                                    idle_timeout=chat_data_idle_timeout,
+                                    max_resident_chats=chat_data_max_resident_chats)
 
     # create the EventHandler and pass it the bot's instance
     updater = Updater(bot=bot, use_context=True, persistence=persistence)
 
     # jobs
+    # serve quests from the last run right away. the first load only needs to fetch what was scanned since
+    if quests_snapshot_file:
+        warm_start()
+    # shiny pokemon are shown right away and updated once the website has been checked for changes
+    load_cached_shinies(shinies_cache_file)
+
+    # slow jobs run on worker threads, so the job queue is free for deleting messages in time
+    background_jobs = BackgroundJobRunner(max_workers=bot_background_workers)
+
     job_queue = updater.job_queue
-    job_queue.run_daily(callback=clear_quests, time=time(hour=0, minute=0, second=0))
-    job_queue.run_repeating(callback=load_quests, interval=300, first=0)
-    job_queue.run_daily(callback=load_shinies, time=time(hour=0, minute=0, second=0))
-    job_queue.run_once(callback=load_shinies, when=0)
+    # runs on the job queue thread, which is the only thread that iterates over the chat data
+    job_queue.run_repeating(callback=evict_chat_data, interval=CHAT_DATA_EVICTION_INTERVAL,
+                            first=CHAT_DATA_EVICTION_INTERVAL)
+    job_queue.run_repeating(callback=background_jobs.wrap(expire_quests, timeout=quests_sweep_interval),
+                            interval=quests_sweep_interval, first=quests_sweep_interval)
+    job_queue.run_repeating(callback=background_jobs.wrap(load_quests, timeout=300), interval=300, first=0)
+    job_queue.run_daily(callback=background_jobs.wrap(load_shinies, timeout=SHINIES_TIMEOUT),
+                        time=time(hour=0, minute=0, second=0))
+    job_queue.run_once(callback=background_jobs.wrap(load_shinies, timeout=SHINIES_TIMEOUT), when=0)
+    if quests_snapshot_file:
+        job_queue.run_repeating(callback=background_jobs.wrap(save_quests, timeout=quests_snapshot_interval),
+                                interval=quests_snapshot_interval, first=quests_snapshot_interval)
+
+    # quests are pushed by MAD right away, polling catches up on anything that was missed
+    if webhook_enabled:
+        start_webhook_server(host=webhook_host, port=webhook_port)
 
     # get the dispatcher to register handlers
     dp = updater.dispatcher
 
+    # keep track of the chats whose data the handlers may change
+    add_chat_data_handlers(dp)
+
     # admin commands
-    dp.add_handler(CallbackQueryHandler(callback=partial(restart, updater=updater), pattern='^restart_bot$'))
-    dp.add_handler(CallbackQueryHandler(callback=partial(git_pull, updater=updater), pattern='^git_pull$'))
+    stop = partial(shut_down, background_jobs=background_jobs, bot=bot)
+    dp.add_handler(CallbackQueryHandler(callback=partial(restart, updater=updater, shut_down=stop),
+                                        pattern='^restart_bot$'))
+    dp.add_handler(CallbackQueryHandler(callback=partial(git_pull, updater=updater, shut_down=stop),
+                                        pattern='^git_pull$'))
 
     # overview
     dp.add_handler(CommandHandler(callback=chat.start, command='start'))
@@ -339,6 +519,8 @@ def main():
     # start_polling() is non-blocking and will stop the bot gracefully.
     updater.idle()
 
+    shut_down(background_jobs, bot)
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,68 @@
+import pickle
+import sqlite3
+
+from datetime import datetime
+from queue import Queue
+
+from telegram import Bot, Chat, Message, Update, User
+from telegram.ext import Dispatcher, TypeHandler
+
+from bot.persistence import SqlitePersistence, add_chat_data_handlers
+
+CHAT_ID = 42
+
+
+def create_dispatcher(database):
+    bot = Bot(token='123:test')
+    persistence = SqlitePersistence(database=database, flush_interval=3600)
+    dispatcher = Dispatcher(bot=bot, update_queue=Queue(), workers=0, persistence=persistence, use_context=True)
+    add_chat_data_handlers(dispatcher)
+    return dispatcher
+
+
+def create_update(bot, update_id=1):
+    chat = Chat(id=CHAT_ID, type=Chat.PRIVATE)
+    message = Message(message_id=update_id, from_user=User(id=CHAT_ID, first_name='test', is_bot=False),
+                      date=datetime.now(), chat=chat, text='test', bot=bot)
+    return Update(update_id=update_id, message=message)
+
+
+def load_saved_chat_data(database):
+    with sqlite3.connect(str(database)) as db:
+        rows = db.execute("SELECT data FROM chat_data WHERE chat_id = ?", (CHAT_ID, )).fetchall()
+    return pickle.loads(rows[0][0]) if rows else None
+
+
+def set_area(update, context):
+    context.chat_data['area'] = 'set'
+
+
+def test_changes_of_handlers_are_saved(tmp_path):
+    database = tmp_path / 'persistence.sqlite'
+    dispatcher = create_dispatcher(str(database))
+    dispatcher.add_handler(TypeHandler(type=Update, callback=set_area))
+
+    dispatcher.process_update(create_update(dispatcher.bot))
+    dispatcher.persistence._write_pending()
+
+    assert dispatcher.chat_data[CHAT_ID] == {'area': 'set'}
+    assert load_saved_chat_data(database) == {'area': 'set'}
+
+
+def test_chats_are_not_saved_after_jobs(tmp_path):
+    database = tmp_path / 'persistence.sqlite'
+    dispatcher = create_dispatcher(str(database))
+    dispatcher.add_handler(TypeHandler(type=Update, callback=set_area))
+
+    dispatcher.process_update(create_update(dispatcher.bot))
+    dispatcher.persistence._write_pending()
+
+    # changed outside of an update, e.g. by a job
+    dispatcher.chat_data[CHAT_ID]['area'] = 'changed'
+    dispatcher.update_persistence()
+    dispatcher.persistence._write_pending()
+    assert load_saved_chat_data(database) == {'area': 'set'}
+
+    # written on shutdown
+    dispatcher.persistence.flush()
+    assert load_saved_chat_data(database) == {'area': 'changed'}